@@ -1,11 +1,1750 @@
+import argparse
 import asyncio
+import base64
+import contextlib
+import csv
+import functools
+import heapq
+import itertools
+import json
 import random
-from typing import List, Tuple, Dict, Optional
+import os
+import signal
+import struct
+import sys
+import time
+from collections import deque
+from datetime import date, datetime
+import multiprocessing as mp
+from typing import Callable, List, Tuple, Dict, Optional
 import aiohttp
+import yarl
 import math
+import numpy as np
+
+try:
+    import socketio  # python-socketio, chỉ cần khi chạy với --transport socket
+except ImportError:
+    socketio = None
+
+try:
+    import orjson  # encoder JSON nhanh cho hot path, không có thì dùng json chuẩn
+except ImportError:
+    orjson = None
+
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine(lng1, lat1, lng2, lat2) -> np.ndarray:
+    """Khoảng cách (km) theo từng phần tử, hỗ trợ broadcast"""
+    lng1, lat1, lng2, lat2 = map(np.radians, (lng1, lat1, lng2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(points: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Khoảng cách (km) giữa mọi cặp điểm, points (N, 2) và targets (M, 2) theo [lng, lat] -> (N, M)"""
+    return haversine(points[:, 0][:, None], points[:, 1][:, None], targets[:, 0][None, :], targets[:, 1][None, :])
+
+
+def snap_stops_to_path(path, stops: List["Stop"], threshold: float = 0.05) -> List[int]:
+    """
+    Tính trước index trên path mà xe tới từng điểm dừng (stops đã sắp theo sequence).
+    Điểm dừng lấy vertex đầu tiên trong bán kính threshold (km) tính từ điểm dừng trước;
+    nếu không có vertex nào đủ gần thì lấy vertex gần nhất, nên không điểm dừng nào bị bỏ qua.
+    """
+    if not stops or not len(path):
+        return []
+
+    distances = haversine_matrix(
+        np.asarray(path, dtype=np.float64),
+        np.asarray([(stop.lng, stop.lat) for stop in stops], dtype=np.float64),
+    )
+    indices = []
+    start = 0
+    for k in range(len(stops)):
+        column = distances[start:, k]
+        near = np.flatnonzero(column < threshold)
+        start += int(near[0]) if near.size else int(np.argmin(column))
+        indices.append(start)
+    return indices
+
+
+class SpeedProfile:
+    """Vận tốc (km/h) không đổi hoặc thay đổi theo giờ trong ngày"""
+
+    def __init__(self, kmh: float = 25.0, by_hour: Optional[Dict[int, float]] = None):
+        self.kmh = kmh
+        # vd. {6: 18, 7: 15, 9: 25}: giờ cao điểm chạy chậm hơn; giờ không có trong bảng dùng kmh
+        self.by_hour = by_hour or {}
+
+    def speed_at(self, clock: float) -> float:
+        """clock: số giây tính từ 0h"""
+        return self.by_hour.get(int(clock // 3600) % 24, self.kmh)
+
+
+class MotionConfig:
+    """Cấu hình chuyển động: tần suất GPS, vận tốc, thời gian dừng ở điểm dừng"""
+
+    def __init__(
+        self,
+        gps_interval: float = 5.0,
+        speed: Optional[SpeedProfile] = None,
+        dwell_range: Tuple[float, float] = (30, 60),
+        chunk_km: float = 0.5,
+    ):
+        self.gps_interval = gps_interval
+        self.speed = speed or SpeedProfile()
+        self.dwell_range = dwell_range
+        # Vận tốc theo giờ được tính lại sau mỗi đoạn chunk_km
+        self.chunk_km = chunk_km
+
+
+class Stop:
+    """Điểm dừng của một trip"""
+
+    __slots__ = ("id", "name", "sequence", "lng", "lat")
+
+    def __init__(self, id: str, name: str, sequence: int, lng: float, lat: float):
+        self.id = id
+        self.name = name
+        self.sequence = sequence
+        self.lng = lng
+        self.lat = lat
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "Stop":
+        lng, lat = data["location"]
+        return cls(data["id"], data.get("name", ""), data.get("sequence", 0), float(lng), float(lat))
+
+
+class Trip:
+    """
+    Chi tiết trip dạng gọn thay cho dict JSON: path là mảng NumPy (N, 2) [lng, lat] chỉ đọc,
+    dùng chung giữa các trip cùng route; stops đã sắp theo sequence.
+    """
+
+    __slots__ = ("id", "route_id", "route_name", "path", "stops")
+
+    def __init__(self, id: str, route_id: str, route_name: str, path: np.ndarray, stops: Tuple[Stop, ...] = ()):
+        self.id = id
+        self.route_id = route_id
+        self.route_name = route_name
+        self.path = path
+        self.stops = stops
+
+    @classmethod
+    def from_json(cls, data: Optional[Dict], paths: Optional[Dict[Tuple, np.ndarray]] = None) -> Optional["Trip"]:
+        """Dựng Trip từ response trip detail; paths (nếu có) là bảng path dùng chung theo route"""
+        if not data:
+            return None
+        route = data.get("rotute") or data.get("route") or {}  # Handle typo
+        stops = tuple(sorted((Stop.from_json(stop) for stop in data.get("stops", [])), key=lambda stop: stop.sequence))
+        route_id = str(route.get("id", ""))
+        return cls(data["id"], route_id, route.get("name", route_id), shared_path(route.get("path") or [], route_id, paths), stops)
+
+
+def shared_path(path: List, route_id: str = "", paths: Optional[Dict[Tuple, np.ndarray]] = None) -> np.ndarray:
+    """Đổi path JSON sang mảng (N, 2) chỉ đọc, dùng lại mảng đã có của cùng route nếu có bảng paths"""
+    key = (route_id, len(path), tuple(path[0]), tuple(path[-1])) if path else None
+    if paths is not None and key in paths:
+        return paths[key]
+    array = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+    array.flags.writeable = False
+    if paths is not None and key is not None:
+        paths[key] = array
+    return array
+
+
+class TripPlan:
+    """
+    Các điểm GPS đã nội suy theo thời gian của một trip, vòng lặp tick chỉ cần index vào.
+    Tick cách đều interval giây nên không lưu mảng thời gian; toạ độ lưu dạng float32 lệch so với
+    điểm gốc (sai số < 1 cm trong phạm vi vài chục km) để mỗi tick chỉ tốn 8 byte.
+    """
+
+    __slots__ = ("interval", "origin_lng", "origin_lat", "offsets", "event_ticks")
+
+    def __init__(self, interval: float, lngs: np.ndarray, lats: np.ndarray, event_ticks: List[int]):
+        self.interval = interval
+        self.origin_lng = float(lngs[0]) if len(lngs) else 0.0
+        self.origin_lat = float(lats[0]) if len(lats) else 0.0
+        self.offsets = np.empty((len(lngs), 2), dtype=np.float32)
+        self.offsets[:, 0] = lngs - self.origin_lng
+        self.offsets[:, 1] = lats - self.origin_lat
+        # [arrive stop 0, depart stop 0, arrive stop 1, ...] theo index tick
+        self.event_ticks = tuple(event_ticks)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def time_at(self, tick: int) -> float:
+        """Số giây từ lúc bắt đầu trip tới tick"""
+        return tick * self.interval
+
+    def position(self, tick: int) -> Tuple[float, float]:
+        """(latitude, longitude) tại tick"""
+        lng, lat = self.offsets[tick].tolist()
+        return self.origin_lat + lat, self.origin_lng + lng
+
+    @property
+    def duration(self) -> float:
+        return self.time_at(len(self) - 1) if len(self) else 0.0
+
+
+def plan_trip(path, stops: List[Stop], motion: MotionConfig, start_clock: Optional[float] = None) -> TripPlan:
+    """
+    Nội suy path theo quãng đường tích lũy, vận tốc và thời gian dừng (stops đã sắp theo sequence),
+    rồi lấy mẫu vị trí mỗi motion.gps_interval giây.
+    """
+    if start_clock is None:
+        now = time.localtime()
+        start_clock = now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec
+
+    coords = np.asarray(path, dtype=np.float64)
+    segments = haversine(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1])
+    cumulative = np.concatenate(([0.0], np.cumsum(segments)))
+    total = float(cumulative[-1])
+
+    # Các mốc trên quãng đường: điểm dừng (giữ thứ tự sequence) và ranh giới chunk
+    stop_distances = cumulative[snap_stops_to_path(path, stops)] if stops else []
+    marks = [(float(d), 0, k) for k, d in enumerate(stop_distances)]
+    marks += [(float(d), 1, -1) for d in np.arange(motion.chunk_km, total, motion.chunk_km)]
+    marks.append((total, 1, -1))
+    marks.sort()
+
+    knot_times = [0.0]
+    knot_distances = [0.0]
+    stop_times = []
+    t = 0.0
+    for distance, _, stop in marks:
+        delta = distance - knot_distances[-1]
+        if delta > 0:
+            t += delta / motion.speed.speed_at(start_clock + t) * 3600
+            knot_times.append(t)
+            knot_distances.append(distance)
+        if stop >= 0:
+            stop_times.append(t)
+            t += random.uniform(*motion.dwell_range)
+            if t > knot_times[-1]:
+                knot_times.append(t)
+                knot_distances.append(distance)
+            stop_times.append(t)
+
+    times = np.arange(int(math.ceil(t / motion.gps_interval)) + 1, dtype=np.float64) * motion.gps_interval
+    distances = np.interp(times, knot_times, knot_distances)
+    lngs = np.interp(distances, cumulative, coords[:, 0])
+    lats = np.interp(distances, cumulative, coords[:, 1])
+    event_ticks = np.minimum(np.searchsorted(times, stop_times), len(times) - 1).tolist()
+    return TripPlan(motion.gps_interval, lngs, lats, event_ticks)
+
+
+# Đồng hồ của simulation: thời gian thực, nén thời gian hoặc discrete-event
+class Clock:
+    """Đồng hồ thời gian thực, thời gian tính bằng epoch giây"""
+
+    factor = 1.0
+
+    def time(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(max(seconds, 0.0) / self.factor)
+
+    async def sleep_until(self, when: float):
+        """Ngủ tới thời điểm tuyệt đối (theo đồng hồ này), không cộng dồn sai lệch"""
+        await self.sleep(when - self.time())
+
+    def seconds_of_day(self) -> float:
+        """Số giây tính từ 0h (giờ địa phương) của thời điểm hiện tại, dùng cho SpeedProfile"""
+        now = self.time()
+        local = time.localtime(now)
+        return local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec + now % 1
+
+    def end_of_day(self) -> float:
+        """Nửa đêm (giờ địa phương) kết thúc ngày hiện tại của đồng hồ"""
+        today = datetime.fromtimestamp(self.time()).replace(hour=0, minute=0, second=0, microsecond=0)
+        return today.timestamp() + 86400
+
+    def perf_counter_at(self, when: float) -> float:
+        """Đổi thời điểm của đồng hồ sang time.perf_counter() để tính độ trễ từ thời điểm dự kiến gửi"""
+        return time.perf_counter() - (self.time() - when) / self.factor
+
+    def busy(self):
+        """Bao quanh một request đang chạy; chỉ DiscreteClock cần biết (để không nhảy thời gian khi còn request)"""
+        return contextlib.nullcontext()
+
+
+class ScaledClock(Clock):
+    """Nén thời gian: mỗi giây thật là factor giây simulation, bắt đầu từ start (epoch)"""
+
+    def __init__(self, factor: float = 60.0, start: Optional[float] = None):
+        self.factor = factor
+        self.start = time.time() if start is None else start
+        self._origin = time.monotonic()
+
+    def time(self) -> float:
+        return self.start + (time.monotonic() - self._origin) * self.factor
+
+
+class DiscreteClock(Clock):
+    """
+    Discrete-event: thời gian không trôi theo đồng hồ thật mà nhảy tới lần thức dậy sớm nhất
+    sau khi các task đang chạy đã được nhường lượt. Request HTTP/socket mất thời gian thật nhưng không
+    tốn thời gian simulation: đồng hồ đứng yên cho tới khi mọi request đang chạy (busy) xong.
+    """
+
+    factor = math.inf
+
+    def __init__(self, start: Optional[float] = None):
+        self.start = time.time() if start is None else start
+        self.now = self.start
+        self._sleepers: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._driver: Optional[asyncio.Task] = None
+        self._in_flight = 0
+        self._idle: Optional[asyncio.Event] = None
+
+    def time(self) -> float:
+        return self.now
+
+    @contextlib.contextmanager
+    def busy(self):
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight and self._idle is not None:
+                self._idle.set()
+
+    async def sleep(self, seconds: float):
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self.now + seconds, next(self._seq), future))
+        if self._driver is None or self._driver.done():
+            self._driver = asyncio.create_task(self._drive())
+        await future
+
+    async def _drive(self):
+        while self._sleepers:
+            # Nhường vài lượt để các task vừa chạy kịp đăng ký lần ngủ tiếp theo
+            for _ in range(3):
+                await asyncio.sleep(0)
+            if self._in_flight:
+                # Chờ các request đang chạy xong, rồi nhường lượt lại cho task vừa nhận response
+                if self._idle is None:
+                    self._idle = asyncio.Event()
+                self._idle.clear()
+                await self._idle.wait()
+                continue
+            if not self._sleepers:
+                break
+            self.now = max(self.now, self._sleepers[0][0])
+            while self._sleepers and self._sleepers[0][0] <= self.now:
+                _, _, future = heapq.heappop(self._sleepers)
+                if not future.done():
+                    future.set_result(None)
+
+    def perf_counter_at(self, when: float) -> float:
+        return time.perf_counter()
+
+    def __getstate__(self):
+        return {"start": self.start}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def parse_clock_start(value: str) -> float:
+    """"HH:MM" (hôm nay, giờ địa phương) hoặc ISO datetime -> epoch giây"""
+    if len(value) <= 5 and ":" in value:
+        hour, minute = (int(part) for part in value.split(":"))
+        return datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0).timestamp()
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def schedule_start_time(schedule: Dict, clock: Clock) -> Optional[float]:
+    """
+    Thời điểm xuất phát (epoch theo clock) của một lịch trình hôm nay: lấy giờ trong ngày của startTime
+    (giờ địa phương) ghép với ngày hiện tại của clock, vì startTime của schedule chỉ mang ý nghĩa giờ.
+    """
+    start_time = schedule.get("startTime")
+    if not start_time:
+        return None
+    try:
+        start = datetime.fromisoformat(start_time.replace("Z", "+00:00")).astimezone()
+    except ValueError:
+        return None
+    today = datetime.fromtimestamp(clock.time())
+    return today.replace(hour=start.hour, minute=start.minute, second=start.second, microsecond=0).timestamp()
+
+
+class LatencyHistogram:
+    """Histogram độ trễ kiểu HDR: bucket log-linear theo micro giây, sai số ~1.6%"""
+
+    SUB_BUCKET_BITS = 7
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def _index(cls, micros: int) -> int:
+        shift = max(micros.bit_length() - cls.SUB_BUCKET_BITS, 0)
+        return (shift << cls.SUB_BUCKET_BITS) | (micros >> shift)
+
+    @classmethod
+    def _value(cls, index: int) -> float:
+        """Giá trị giữa bucket (giây)"""
+        shift = index >> cls.SUB_BUCKET_BITS
+        sub = index & ((1 << cls.SUB_BUCKET_BITS) - 1)
+        low = sub << shift
+        high = ((sub + 1) << shift) - 1
+        return (low + high) / 2 / 1e6
+
+    def record(self, seconds: float):
+        index = self._index(int(seconds * 1e6))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """Độ trễ (giây) tại phân vị p (0-100)"""
+        if not self.count:
+            return 0.0
+        target = max(int(math.ceil(self.count * p / 100)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def to_dict(self) -> Dict:
+        return {"counts": self.counts, "count": self.count, "total": self.total, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LatencyHistogram":
+        histogram = cls()
+        histogram.counts = {int(k): v for k, v in data["counts"].items()}
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.max = data["max"]
+        return histogram
+
+
+# 304 là kết quả hợp lệ của request có If-None-Match
+OK_STATUSES = (200, 304)
+
+
+class RequestStats:
+    """Thống kê theo endpoint: histogram độ trễ, số lượng theo status code; gộp được giữa nhiều process"""
+
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.status_codes: Dict[str, Dict[int, int]] = {}
+
+    def record(self, endpoint: str, status: int, latency: float):
+        """status = 0 nghĩa là request lỗi trước khi có response"""
+        histogram = self.histograms.get(endpoint)
+        if histogram is None:
+            histogram = self.histograms[endpoint] = LatencyHistogram()
+            self.status_codes[endpoint] = {}
+        histogram.record(latency)
+        codes = self.status_codes[endpoint]
+        codes[status] = codes.get(status, 0) + 1
+
+    @property
+    def requests(self) -> int:
+        return sum(histogram.count for histogram in self.histograms.values())
+
+    @property
+    def errors(self) -> int:
+        return sum(
+            count
+            for codes in self.status_codes.values()
+            for status, count in codes.items()
+            if status not in OK_STATUSES
+        )
+
+    def to_dict(self) -> Dict:
+        total = LatencyHistogram()
+        for histogram in self.histograms.values():
+            total.merge(histogram)
+        return {
+            "started": self.started,
+            "requests": total.count,
+            "errors": self.errors,
+            "latency_sum": total.total,
+            "latency_max": total.max,
+            "endpoints": {
+                endpoint: {
+                    "histogram": histogram.to_dict(),
+                    "status": self.status_codes[endpoint],
+                }
+                for endpoint, histogram in self.histograms.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RequestStats":
+        stats = cls()
+        stats.started = data.get("started", stats.started)
+        for endpoint, item in data.get("endpoints", {}).items():
+            stats.histograms[endpoint] = LatencyHistogram.from_dict(item["histogram"])
+            stats.status_codes[endpoint] = {int(k): v for k, v in item["status"].items()}
+        return stats
+
+    def merge(self, other: "RequestStats"):
+        self.started = min(self.started, other.started)
+        for endpoint, histogram in other.histograms.items():
+            if endpoint not in self.histograms:
+                self.histograms[endpoint] = LatencyHistogram()
+                self.status_codes[endpoint] = {}
+            self.histograms[endpoint].merge(histogram)
+            codes = self.status_codes[endpoint]
+            for status, count in other.status_codes[endpoint].items():
+                codes[status] = codes.get(status, 0) + count
+
+    @classmethod
+    def merge_all(cls, snapshots: List[Dict]) -> "RequestStats":
+        """Gộp các snapshot to_dict() từ nhiều worker"""
+        total = cls()
+        for snapshot in snapshots:
+            total.merge(cls.from_dict(snapshot))
+        return total
+
+    def report(self) -> List[Dict]:
+        """Mỗi endpoint một dòng: số request, tốc độ, phân vị độ trễ (ms), status code"""
+        elapsed = max(time.time() - self.started, 1e-9)
+        rows = []
+        for endpoint in sorted(self.histograms):
+            histogram = self.histograms[endpoint]
+            codes = self.status_codes[endpoint]
+            row = {
+                "endpoint": endpoint,
+                "requests": histogram.count,
+                "errors": sum(count for status, count in codes.items() if status not in OK_STATUSES),
+                "rate": round(histogram.count / elapsed, 3),
+            }
+            for p in self.PERCENTILES:
+                row[f"p{p:g}_ms"] = round(histogram.percentile(p) * 1000, 3)
+            row["max_ms"] = round(histogram.max * 1000, 3)
+            row["status"] = ";".join(f"{status}:{count}" for status, count in sorted(codes.items()))
+            rows.append(row)
+        return rows
+
+    def dump(self, prefix: str):
+        """Ghi thống kê ra <prefix>.json và <prefix>.csv"""
+        rows = self.report()
+        with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+            json.dump({"generated": time.time(), "endpoints": rows}, f, ensure_ascii=False, indent=4)
+
+        with open(f"{prefix}.csv", "w", encoding="utf-8", newline="") as f:
+            if rows:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+
+    def print_report(self):
+        for row in self.report():
+            print(
+                f"📊 {row['endpoint']}: {row['requests']} req ({row['rate']:.1f}/s), {row['errors']} err, "
+                f"p50 {row['p50_ms']:.1f} / p90 {row['p90_ms']:.1f} / p99 {row['p99_ms']:.1f} / "
+                f"p99.9 {row['p99.9_ms']:.1f} / max {row['max_ms']:.1f} ms [{row['status']}]"
+            )
+
+
+async def dump_stats_periodically(stats: RequestStats, prefix: str, interval: float = 60.0):
+    """Ghi thống kê định kỳ cho tới khi task bị hủy"""
+    while True:
+        await asyncio.sleep(interval)
+        stats.dump(prefix)
+
+
+async def finish_stats(stats: RequestStats, prefix: Optional[str], dump_task: Optional[asyncio.Task]):
+    """Dừng việc ghi định kỳ, in báo cáo cuối và ghi file lần cuối"""
+    if dump_task is not None:
+        dump_task.cancel()
+        await asyncio.gather(dump_task, return_exceptions=True)
+    stats.print_report()
+    if prefix:
+        stats.dump(prefix)
+
+
+# Log sự kiện theo level, ghi theo lô thay cho print từng dòng
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LOG_LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LOG_LEVELS.items()}
+
+
+class EventLog:
+    """
+    Log sự kiện theo level. Bản ghi được đưa vào buffer (chưa format) và ghi theo lô mỗi flush_interval:
+    ra console nếu đạt console_level, ra file (ở thread riêng) nếu đạt file_level.
+    Khi chưa start() thì ghi ngay như print.
+    """
+
+    def __init__(
+        self,
+        console_level: Optional[int] = INFO,
+        path: Optional[str] = None,
+        file_level: int = DEBUG,
+        flush_interval: float = 0.5,
+        max_buffer: int = 100000,
+    ):
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.configure(console_level, path, file_level)
+        self.dropped = 0
+        self._buffer: deque = deque()
+        self._file = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._pending: Optional[asyncio.Future] = None
+
+    def configure(self, console_level: Optional[int] = INFO, path: Optional[str] = None, file_level: int = DEBUG):
+        """console_level = None: tắt log console (vd. khi dùng dashboard)"""
+        self.console_level = console_level
+        self.path = path
+        self.file_level = file_level
+        # Ngưỡng chung để bỏ qua bản ghi không sink nào cần mà không tốn công format
+        levels = [console_level] if console_level is not None else []
+        if path:
+            levels.append(file_level)
+        self.level = min(levels) if levels else ERROR + 1
+
+    def log(self, level: int, msg: str, *args):
+        if level < self.level:
+            return
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append((time.time(), level, msg, args))
+        if self._flusher is None:
+            self._write(self._drain())
+
+    def debug(self, msg: str, *args):
+        self.log(DEBUG, msg, *args)
+
+    def info(self, msg: str, *args):
+        self.log(INFO, msg, *args)
+
+    def warning(self, msg: str, *args):
+        self.log(WARNING, msg, *args)
+
+    def error(self, msg: str, *args):
+        self.log(ERROR, msg, *args)
+
+    def _drain(self) -> Tuple[str, str]:
+        """Format các bản ghi đang chờ, trả về (text cho console, text cho file)"""
+        console, lines = [], []
+        while self._buffer:
+            created, level, msg, args = self._buffer.popleft()
+            text = msg % args if args else msg
+            if self.console_level is not None and level >= self.console_level:
+                console.append(text)
+            if self.path and level >= self.file_level:
+                stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created))
+                lines.append(f"{stamp}.{int(created % 1 * 1000):03d} {LEVEL_NAMES[level]:<7} {text}")
+        return "\n".join(console), "\n".join(lines)
+
+    def _write(self, batch: Tuple[str, str]):
+        console, lines = batch
+        if console:
+            sys.stdout.write(console + "\n")
+            sys.stdout.flush()
+        if lines:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(lines + "\n")
+            self._file.flush()
+
+    async def _flush_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._buffer:
+                # Format trên event loop (bản ghi không bị đổi giữa chừng), ghi ở thread riêng
+                self._pending = loop.run_in_executor(None, self._write, self._drain())
+                await asyncio.shield(self._pending)
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._pending is not None:
+            await asyncio.gather(self._pending, return_exceptions=True)
+            self._pending = None
+        self._write(self._drain())
+        if self.dropped:
+            print(f"⚠️  Event log dropped {self.dropped} records (buffer full)")
+            self.dropped = 0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+event_log = EventLog()
+
+
+class Dashboard:
+    """Bảng tổng hợp in ra console mỗi giây: số trip đang chạy, request/s, lỗi, phân vị độ trễ theo endpoint"""
+
+    def __init__(self, stats: RequestStats, active_trips: Callable[[], int], interval: float = 1.0):
+        self.stats = stats
+        self.active_trips = active_trips
+        self.interval = interval
+        # Xoá màn hình và vẽ lại khi là terminal, còn lại (pipe, file) thì in nối tiếp
+        self.redraw = sys.stdout.isatty()
+        self._last_counts: Dict[str, Tuple[int, int]] = {}
+        self._last_time = time.monotonic()
+
+    def render(self) -> str:
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-9)
+        self._last_time = now
+
+        rows = []
+        total_rate = total_errors = new_errors = 0.0
+        for endpoint in sorted(self.stats.histograms):
+            histogram = self.stats.histograms[endpoint]
+            errors = sum(
+                count for status, count in self.stats.status_codes[endpoint].items() if status not in OK_STATUSES
+            )
+            last_count, last_errors = self._last_counts.get(endpoint, (0, 0))
+            self._last_counts[endpoint] = (histogram.count, errors)
+            rate = (histogram.count - last_count) / elapsed
+            total_rate += rate
+            total_errors += errors
+            new_errors += errors - last_errors
+            rows.append(
+                f"  {endpoint:<58} {rate:>8.1f}/s {errors:>7} err  p50 {histogram.percentile(50) * 1000:>7.1f}  "
+                f"p99 {histogram.percentile(99) * 1000:>7.1f}  max {histogram.max * 1000:>7.1f} ms"
+            )
+
+        header = (
+            f"🚌 {self.active_trips()} active trips | {total_rate:.1f} req/s | "
+            f"{int(total_errors)} errors (+{int(new_errors)}) | up {time.time() - self.stats.started:.0f}s"
+        )
+        return "\n".join([header, *rows])
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            text = self.render()
+            sys.stdout.write(("\x1b[H\x1b[2J" if self.redraw else "") + text + "\n")
+            sys.stdout.flush()
+
+
+# Status giả cho request bị circuit breaker chặn, không được gửi và không tính vào RequestStats
+SHED = -1
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+BREAKER_CLOSED = 0
+BREAKER_OPEN = 1
+BREAKER_HALF_OPEN = 2
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff với full jitter: ngẫu nhiên trong [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_overloaded(status: int) -> bool:
+    """Lỗi cho thấy server quá tải hoặc không tới được (không phải lỗi nghiệp vụ như 400/404)"""
+    return status == 0 or status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    """
+    Breaker của một endpoint: mở sau failure_threshold lỗi quá tải liên tiếp, chặn request trong reset_timeout giây,
+    sau đó cho đúng một request thử (half-open); thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    __slots__ = ("failure_threshold", "reset_timeout", "state", "failures", "opened_at", "probing")
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.state == BREAKER_CLOSED:
+            return True
+        if self.state == BREAKER_OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = BREAKER_HALF_OPEN
+            self.probing = False
+        if self.state == BREAKER_HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def is_open(self) -> bool:
+        """True nếu request lúc này chắc chắn bị chặn (không dùng mất lượt thử của half-open)"""
+        if self.state == BREAKER_CLOSED:
+            return False
+        if self.state == BREAKER_OPEN:
+            return time.monotonic() - self.opened_at < self.reset_timeout
+        return self.probing
+
+    def record(self, failed: bool) -> bool:
+        """Cập nhật trạng thái theo kết quả request, trả về True nếu breaker vừa mở"""
+        if not failed:
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+            self.probing = False
+            return False
+        self.failures += 1
+        if self.state == BREAKER_HALF_OPEN or (self.state == BREAKER_CLOSED and self.failures >= self.failure_threshold):
+            self.state = BREAKER_OPEN
+            self.opened_at = time.monotonic()
+            self.probing = False
+            return True
+        return False
+
+
+class FlowControl:
+    """
+    Chống dồn tải khi server chậm: giới hạn request đang chạy cho cả đội xe (và cho mỗi xe qua per_bus),
+    retry request idempotent với exponential backoff + jitter, circuit breaker theo endpoint.
+    Mỗi quyết định được đếm trong counters.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 1000,
+        per_bus: int = 4,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 10.0,
+    ):
+        self.max_in_flight = max_in_flight
+        self.per_bus = per_bus
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.counters = {
+            "throttled": 0,  # phải chờ slot in-flight (của xe hoặc của cả đội)
+            "retried": 0,
+            "gave_up": 0,  # hết số lần retry mà vẫn lỗi
+            "rejected": 0,  # bị breaker chặn, không gửi
+            "shed": 0,  # vị trí bị bỏ khi breaker mở (chỉ giữ vị trí mới nhất)
+            "opened": 0,  # số lần breaker mở
+        }
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    async def _acquire(self, semaphore: asyncio.Semaphore):
+        if semaphore.locked():
+            self.counters["throttled"] += 1
+        await semaphore.acquire()
+
+    async def send(self, endpoint: str, method: str, call, bus_slots: Optional[asyncio.Semaphore] = None):
+        """call() -> (status, ...); request bị breaker chặn trả về (SHED, None, None)"""
+        if self._slots is None:
+            # Tạo lười để object vẫn pickle được khi truyền sang worker process
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self.counters["rejected"] += 1
+                return SHED, None, None
+
+            error = None
+            if bus_slots is not None:
+                await self._acquire(bus_slots)
+            try:
+                await self._acquire(self._slots)
+                try:
+                    result = await call()
+                    failed = is_overloaded(result[0])
+                except Exception as e:
+                    error, failed = e, True
+                finally:
+                    self._slots.release()
+            finally:
+                if bus_slots is not None:
+                    bus_slots.release()
+
+            if breaker.record(failed):
+                self.counters["opened"] += 1
+                event_log.warning("🔌 Circuit opened for %s", endpoint)
+            if not failed:
+                return result
+            if method not in IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                if attempt:
+                    self.counters["gave_up"] += 1
+                if error is not None:
+                    raise error
+                return result
+
+            attempt += 1
+            self.counters["retried"] += 1
+            await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+
+    def report(self) -> str:
+        open_endpoints = sum(breaker.state != BREAKER_CLOSED for breaker in self.breakers.values())
+        counters = ", ".join(f"{count} {name}" for name, count in self.counters.items())
+        return f"🚦 Flow control: {counters}; {open_endpoints} circuits not closed"
+
+    def __getstate__(self):
+        return {
+            key: getattr(self, key)
+            for key in (
+                "max_in_flight", "per_bus", "max_retries", "backoff_base", "backoff_cap",
+                "failure_threshold", "reset_timeout",
+            )
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class HttpTransport:
+    """Connection pool dùng chung cho cả đội xe (keep-alive, giới hạn kết nối, cache DNS)"""
+
+    def __init__(
+        self,
+        limit: int = 1000,
+        limit_per_host: int = 100,
+        ttl_dns_cache: int = 300,
+        keepalive_timeout: float = 30.0,
+        timeout: float = 30.0,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.stats = RequestStats()
+        # Gán RequestRecorder để ghi lại mọi request đi qua transport (một lần mỗi request, không tính retry)
+        self.recorder: Optional["RequestRecorder"] = None
+        # Gán FlowControl để giới hạn in-flight, retry và circuit breaking cho mọi request đi qua transport
+        self.flow: Optional[FlowControl] = None
+        # Clock của simulation, để DiscreteClock không cho thời gian trôi khi còn request đang chạy
+        self.clock: Clock = Clock()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Session phải được tạo bên trong event loop nên khởi tạo lười
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.ttl_dns_cache,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict] = None,
+        json: Optional[Dict] = None,
+        endpoint: Optional[str] = None,
+        intended: Optional[float] = None,
+        bus_slots: Optional[asyncio.Semaphore] = None,
+        body: Optional[bytes] = None,
+    ) -> Tuple[int, Optional[Dict]]:
+        """
+        Gửi request, trả về (status, body JSON hoặc None); status = SHED nếu bị circuit breaker chặn.
+        intended: thời điểm (time.perf_counter) request lẽ ra được gửi; độ trễ được tính từ đó
+        để không che mất thời gian chờ khi client bị tụt lịch (coordinated omission).
+        bus_slots: giới hạn in-flight riêng của một xe (khi có FlowControl)
+        body: JSON đã encode sẵn, gửi nguyên văn thay cho json (headers phải có Content-Type)
+        """
+        status, data, _ = await self._send(method, url, headers, json, endpoint, intended, bus_slots, body)
+        return status, data
+
+    async def conditional_get(
+        self,
+        url: str,
+        headers: Optional[Dict] = None,
+        etag: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        bus_slots: Optional[asyncio.Semaphore] = None,
+    ) -> Tuple[int, Optional[Dict], Optional[str]]:
+        """GET kèm If-None-Match, trả về (status, body JSON hoặc None, ETag mới)"""
+        if etag:
+            headers = {**(headers or {}), "If-None-Match": etag}
+        return await self._send("GET", url, headers, None, endpoint, bus_slots=bus_slots)
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict],
+        json: Optional[Dict],
+        endpoint: Optional[str],
+        intended: Optional[float] = None,
+        bus_slots: Optional[asyncio.Semaphore] = None,
+        body: Optional[bytes] = None,
+    ) -> Tuple[int, Optional[Dict], Optional[str]]:
+        if self.recorder is not None:
+            self.recorder.record(method, url, headers, json if body is None else body, endpoint)
+        with self.clock.busy():
+            if self.flow is None:
+                return await self._attempt(method, url, headers, json, endpoint, intended, body)
+            return await self.flow.send(
+                f"{method} {endpoint or url}",
+                method,
+                functools.partial(self._attempt, method, url, headers, json, endpoint, intended, body),
+                bus_slots,
+            )
+
+    async def _attempt(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict],
+        json: Optional[Dict],
+        endpoint: Optional[str],
+        intended: Optional[float] = None,
+        body: Optional[bytes] = None,
+    ) -> Tuple[int, Optional[Dict], Optional[str]]:
+        started = time.perf_counter() if intended is None else intended
+        status = 0
+        try:
+            async with self.session.request(method, url, headers=headers, json=json, data=body) as response:
+                status = response.status
+                data = None
+                if status == 200:
+                    data = await response.json(content_type=None)
+                else:
+                    # Đọc hết body để connection được trả về pool
+                    await response.read()
+                return status, data, response.headers.get("ETag")
+        finally:
+            self.stats.record(f"{method} {endpoint or url}", status, time.perf_counter() - started)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# Ghi lại và phát lại request để benchmark server một cách lặp lại được
+LOG_MAGIC = b"BSRL\x01"
+LOG_STRING = 0
+LOG_REQUEST = 1
+LOG_LOCATION = 2
+LOG_METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE"]
+
+_LOG_KIND = struct.Struct("<B")
+_LOG_STRING = struct.Struct("<IH")
+_LOG_REQUEST = struct.Struct("<dBIIII")
+_LOG_LOCATION = struct.Struct("<dIIIdd")
+
+
+class RequestRecorder:
+    """
+    Ghi mọi request ra log nhị phân chỉ-ghi-thêm. Path, endpoint và token được intern thành id;
+    request cập nhật vị trí chỉ tốn 37 byte.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+        self._strings: Dict[str, int] = {}
+        self._started = time.monotonic()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab", buffering=1 << 16)
+        if is_new:
+            self._file.write(LOG_MAGIC)
+
+    def _intern(self, value: str) -> int:
+        string_id = self._strings.get(value)
+        if string_id is None:
+            string_id = self._strings[value] = len(self._strings)
+            raw = value.encode("utf-8")
+            self._file.write(_LOG_KIND.pack(LOG_STRING) + _LOG_STRING.pack(string_id, len(raw)) + raw)
+        return string_id
+
+    def record(self, method: str, url: str, headers: Optional[Dict], payload, endpoint: Optional[str]):
+        """payload là dict JSON hoặc body đã encode sẵn (bytes)"""
+        t = time.monotonic() - self._started
+        if isinstance(payload, bytes):
+            payload = json.loads(payload)
+        path = yarl.URL(url).path_qs
+        token_id = self._intern((headers or {}).get("Authorization", ""))
+        path_id = self._intern(path)
+        endpoint_id = self._intern(endpoint or path)
+
+        if method == "POST" and payload is not None and payload.keys() == {"latitude", "longitude"}:
+            self._file.write(_LOG_KIND.pack(LOG_LOCATION) + _LOG_LOCATION.pack(
+                t, token_id, path_id, endpoint_id, payload["latitude"], payload["longitude"]
+            ))
+        else:
+            body = json.dumps(payload, separators=(",", ":")).encode("utf-8") if payload is not None else b""
+            self._file.write(_LOG_KIND.pack(LOG_REQUEST) + _LOG_REQUEST.pack(
+                t, LOG_METHODS.index(method), token_id, path_id, endpoint_id, len(body)
+            ) + body)
+        self.records += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_request_log(path: str):
+    """Đọc log, yield (t, method, path, authorization, endpoint, payload)"""
+    strings: List[str] = []
+    offset = 0.0
+    last = 0.0
+    with open(path, "rb") as f:
+        if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError(f"{path} is not a request log")
+        while True:
+            kind = f.read(_LOG_KIND.size)
+            if not kind:
+                return
+            kind = _LOG_KIND.unpack(kind)[0]
+            if kind == LOG_STRING:
+                string_id, length = _LOG_STRING.unpack(f.read(_LOG_STRING.size))
+                # Log được ghi thêm qua nhiều lần chạy, mỗi lần đánh id và thời gian lại từ 0
+                if string_id == 0 and strings:
+                    strings = []
+                    offset = last
+                strings.append(f.read(length).decode("utf-8"))
+            elif kind == LOG_LOCATION:
+                t, token_id, path_id, endpoint_id, latitude, longitude = _LOG_LOCATION.unpack(f.read(_LOG_LOCATION.size))
+                payload = {"latitude": latitude, "longitude": longitude}
+                last = t + offset
+                yield last, "POST", strings[path_id], strings[token_id], strings[endpoint_id], payload
+            elif kind == LOG_REQUEST:
+                t, method, token_id, path_id, endpoint_id, length = _LOG_REQUEST.unpack(f.read(_LOG_REQUEST.size))
+                payload = json.loads(f.read(length)) if length else None
+                last = t + offset
+                yield last, LOG_METHODS[method], strings[path_id], strings[token_id], strings[endpoint_id], payload
+            else:
+                raise ValueError(f"Unknown record kind {kind} in {path}")
+
+
+async def replay_request_log(
+    path: str,
+    base_url: str = "http://localhost:3000",
+    transport: Optional[HttpTransport] = None,
+    speed: float = 1.0,
+    max_in_flight: int = 500,
+    metrics_prefix: Optional[str] = None,
+    token_pool: Optional["TokenPool"] = None,
+    credentials: Optional[List[Tuple[str, str]]] = None,
+):
+    """
+    Phát lại log: speed = 1 giữ nguyên nhịp gốc, speed = k nhanh gấp k lần, speed = 0 nhanh nhất có thể.
+    Có token_pool thì đăng nhập credentials và mỗi token trong log (theo thứ tự xuất hiện) được thay bằng
+    token còn hạn của một tài khoản; không có thì dùng lại token đã ghi.
+    """
+    transport = transport or HttpTransport()
+    slots = asyncio.Semaphore(max_in_flight)
+    in_flight = set()
+    loop = asyncio.get_running_loop()
+    sent = 0
+
+    sessions: List[DriverSession] = []
+    if token_pool is not None:
+        sessions = await token_pool.login_all(credentials or [])
+        if not sessions:
+            print("❌ No driver could log in, check --accounts and the API server")
+            await token_pool.close()
+            return
+        token_pool.start()
+    drivers: Dict[str, DriverSession] = {}
+    expired = set()
+
+    def session_for(authorization: str) -> Optional[DriverSession]:
+        if not sessions or not authorization:
+            return None
+        session = drivers.get(authorization)
+        if session is None:
+            session = drivers[authorization] = sessions[len(drivers) % len(sessions)]
+            if len(drivers) == len(sessions) + 1:
+                print(f"⚠️  The log has more drivers than --accounts ({len(sessions)}), some accounts replay several drivers")
+        return session
+
+    async def send(method: str, url: str, authorization: str, payload: Optional[Dict], endpoint: str):
+        session = session_for(authorization)
+        try:
+            for attempt in range(2):
+                if session is not None:
+                    authorization = f"Bearer {session.access_token}"
+                headers = {"Authorization": authorization, "Content-Type": "application/json"}
+                status, _ = await transport.request(method, url, headers=headers, json=payload, endpoint=endpoint)
+                if status != 401 or session is None or attempt:
+                    break
+                # Token hết hạn giữa lúc phát lại: refresh rồi gửi lại một lần
+                await token_pool.refresh(session, session.access_token)
+        except Exception:
+            pass  # Lỗi đã được tính trong transport.stats
+        finally:
+            slots.release()
+
+    print(f"⏯️  Replaying {path} against {base_url}")
+    started = loop.time()
+    try:
+        for t, method, request_path, authorization, endpoint, payload in read_request_log(path):
+            if token_pool is None and authorization not in expired:
+                expiry = jwt_expiry(authorization.removeprefix("Bearer "))
+                if expiry is not None and expiry <= time.time():
+                    expired.add(authorization)
+            if speed > 0:
+                delay = started + t / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await slots.acquire()
+            task = asyncio.create_task(send(method, f"{base_url}{request_path}", authorization, payload, endpoint))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            sent += 1
+        await asyncio.gather(*in_flight, return_exceptions=True)
+    finally:
+        if token_pool is not None:
+            await token_pool.close()
+        if expired:
+            print(f"⚠️  {len(expired)} recorded tokens had expired, pass --accounts to replay with fresh tokens")
+        await transport.close()
+        elapsed = max(loop.time() - started, 1e-9)
+        print(f"⏹️  Replayed {sent} requests in {elapsed:.2f}s ({sent / elapsed:.1f} req/s)")
+        await finish_stats(transport.stats, metrics_prefix, None)
+
+
+class CacheEntry:
+    __slots__ = ("data", "etag", "expires")
+
+    def __init__(self, data, etag: Optional[str], expires: float):
+        self.data = data
+        self.etag = etag
+        self.expires = expires
+
+
+class LookupCache:
+    """
+    Cache lịch trình và chi tiết trip dùng chung cho cả đội xe: hết TTL thì revalidate bằng ETag,
+    các request trùng key đang chạy được gộp lại, path của route được dùng chung theo route id.
+    TTL tính theo clock của simulation để khi nén thời gian hoặc chạy discrete-event lịch không bị cũ hàng giờ.
+    """
+
+    DEFAULT_TTLS = {
+        "/api/drivers/schedules/today": 60.0,
+        "/api/drivers/trip/{trip_id}": 300.0,
+    }
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None, clock: Optional[Clock] = None):
+        # TTL (giây của clock) theo path template
+        self.ttls = {**self.DEFAULT_TTLS, **(ttls or {})}
+        self.clock = clock or Clock()
+        self.entries: Dict[str, CacheEntry] = {}
+        # Path (mảng chỉ đọc) dùng chung cho mọi trip cùng route
+        self.route_paths: Dict[Tuple, np.ndarray] = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def ttl_for(self, path: str) -> float:
+        return self.ttls.get(path, 0.0)
+
+    def invalidate(self, key: str):
+        self.entries.pop(key, None)
+
+    async def get(self, key: str, ttl: float, fetch, transform=None) -> Tuple[int, Optional[Dict]]:
+        """fetch(etag) -> (status, data, etag); transform(data) chạy một lần khi có body mới"""
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires > self.clock.time():
+            self.hits += 1
+            return 200, entry.data
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            status, data, etag = await fetch(entry.etag if entry is not None else None)
+            if status == 304 and entry is not None:
+                self.revalidated += 1
+                entry.expires = self.clock.time() + ttl
+                result = (200, entry.data)
+            elif status == 200:
+                self.misses += 1
+                if transform is not None:
+                    data = transform(data)
+                self.entries[key] = CacheEntry(data, etag, self.clock.time() + ttl)
+                result = (200, data)
+            else:
+                result = (status, None)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Tránh cảnh báo "exception was never retrieved" khi không có ai chờ
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def parse_trip(self, data: Optional[Dict]) -> Optional[Trip]:
+        """Đổi response trip detail sang Trip, path dùng chung với các trip cùng route"""
+        return Trip.from_json((data or {}).get("data"), self.route_paths)
+
+    def report(self) -> str:
+        return (
+            f"🗃️  Cache: {self.hits} hits, {self.revalidated} revalidated (304), {self.misses} misses, "
+            f"{len(self.route_paths)} unique route paths"
+        )
+
+
+class SocketTransport:
+    """
+    Một kết nối socket.io lâu dài cho mỗi xe, dùng để stream vị trí (UpdateLocation, xem src/utils/socketio.ts).
+    Server ack bằng {ok, status, message}; các sự kiện điểm dừng/học sinh vẫn đi qua HTTP.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        access_token: str,
+        stats: Optional[RequestStats] = None,
+        namespace: str = "/",
+        ack_timeout: Optional[float] = 5.0,
+    ):
+        if socketio is None:
+            raise RuntimeError("python-socketio is required for the socket transport (pip install python-socketio[asyncio_client])")
+        self.base_url = base_url
+        self.access_token = access_token
+        self.stats = stats or RequestStats()
+        self.namespace = namespace
+        # Mặc định chờ ack để event không có handler ở server bị tính là lỗi (timeout);
+        # None: emit không chờ ack, chỉ đo thời gian ghi ra socket nên được thống kê dưới tên riêng
+        self.ack_timeout = ack_timeout
+        self.client = socketio.AsyncClient(reconnection=True)
+        self.clock: Clock = Clock()
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self.client.connected:
+                return
+            await self.client.connect(
+                self.base_url,
+                headers={"Authorization": f"Bearer {self.access_token}"},
+                auth={"token": self.access_token},
+                transports=["websocket"],
+                namespaces=[self.namespace],
+            )
+
+    async def emit(self, event: str, *data, intended: Optional[float] = None, ack: bool = True) -> bool:
+        """ack=False cho event mà server không ack (vd. joinTripRoom)"""
+        started = time.perf_counter() if intended is None else intended
+        wait_ack = ack and self.ack_timeout is not None
+        status = 0
+        try:
+            with self.clock.busy():
+                await self.connect()
+                if not wait_ack:
+                    await self.client.emit(event, data=data, namespace=self.namespace)
+                    status = 200
+                else:
+                    result = await self.client.call(event, data=data, namespace=self.namespace, timeout=self.ack_timeout)
+                    status = result.get("status", 200 if result.get("ok") else 0) if isinstance(result, dict) else 200
+                    if status != 200:
+                        event_log.warning("❌ Error on %s: %s %s", event, status, result.get("message", ""))
+            return status == 200
+        finally:
+            # Số liệu không ack không so được với HTTP (server có thể bỏ qua event) nên tách tên endpoint
+            endpoint = f"SOCKET {event}" if wait_ack else f"SOCKET (no ack) {event}"
+            self.stats.record(endpoint, status, time.perf_counter() - started)
+
+    async def close(self):
+        if self.client.connected:
+            await self.client.disconnect()
+
+
+class OpenLoopSender:
+    """
+    Gửi request theo lịch cố định, không chờ response của request trước (open-loop).
+    Giới hạn số request đang chạy; request vượt giới hạn phải xếp hàng (vẫn tính độ trễ từ thời điểm dự kiến),
+    hàng đợi vượt max_backlog thì bị bỏ và được đếm lại.
+    Request gửi kèm key (trip id) có thể được chờ bằng flush(key), vd. để end_trip không đến trước vị trí cuối.
+    """
+
+    def __init__(self, max_in_flight: int = 100, max_backlog: int = 10000, flush_timeout: float = 30.0):
+        self.max_in_flight = max_in_flight
+        self.max_backlog = max_backlog
+        self.flush_timeout = flush_timeout
+        self.submitted = 0
+        self.dropped = 0
+        self.outstanding = 0
+        self.unflushed = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        self._pending: Dict[str, set] = {}
+
+    def submit(self, send, intended: float, key: Optional[str] = None) -> bool:
+        """send(intended) -> coroutine; intended theo time.perf_counter"""
+        if self._slots is None:
+            # Tạo lười để object vẫn pickle được khi truyền sang worker process
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        if self.outstanding - self.max_in_flight >= self.max_backlog:
+            self.dropped += 1
+            return False
+
+        self.submitted += 1
+        self.outstanding += 1
+        task = asyncio.create_task(self._run(send, intended))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if key is not None:
+            pending = self._pending.setdefault(key, set())
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        return True
+
+    async def _run(self, send, intended: float):
+        try:
+            async with self._slots:
+                await send(intended)
+        finally:
+            self.outstanding -= 1
+
+    async def flush(self, key: str) -> int:
+        """Chờ các request đã gửi với key xong (tối đa flush_timeout giây), trả về số request còn chưa xong"""
+        pending = self._pending.pop(key, None)
+        if not pending:
+            return 0
+        _, not_done = await asyncio.wait(set(pending), timeout=self.flush_timeout)
+        if not_done:
+            self.unflushed += len(not_done)
+            event_log.warning("⚠️  %s location requests of %s still pending after %gs", len(not_done), key, self.flush_timeout)
+        return len(not_done)
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def report(self) -> str:
+        return (
+            f"📤 Open-loop: {self.submitted} submitted, {self.dropped} dropped, {self.outstanding} outstanding, "
+            f"{self.unflushed} still pending at trip end"
+        )
+
+    def __getstate__(self):
+        return {"max_in_flight": self.max_in_flight, "max_backlog": self.max_backlog, "flush_timeout": self.flush_timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def jwt_expiry(token: Optional[str]) -> Optional[float]:
+    """Đọc claim exp (epoch giây) của JWT mà không verify chữ ký"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class DriverSession:
+    """Tài khoản driver cùng cặp access/refresh token hiện tại"""
+
+    __slots__ = ("username", "password", "access_token", "refresh_token", "expires_at", "refresh_at")
+
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self.access_token: Optional[str] = None
+        self.refresh_token: Optional[str] = None
+        self.expires_at = 0.0
+        self.refresh_at = 0.0
+
+    def set_access_token(self, token: str, refresh_ahead: float):
+        self.access_token = token
+        self.expires_at = jwt_expiry(token) or time.time() + refresh_ahead * 2
+        # Refresh ngẫu nhiên trong khoảng [refresh_ahead, 2 * refresh_ahead] trước khi hết hạn
+        # để các token cấp cùng lúc không hết hạn và refresh cùng lúc
+        self.refresh_at = self.expires_at - refresh_ahead * (1 + random.random())
+
+    def needs_refresh(self) -> bool:
+        return not self.access_token or time.time() >= self.refresh_at
+
+    def can_refresh(self) -> bool:
+        expiry = jwt_expiry(self.refresh_token)
+        return bool(self.refresh_token) and (expiry is None or expiry > time.time())
+
+
+class TokenPool:
+    """
+    Đăng nhập hàng loạt tài khoản driver qua /api/auth/login (giới hạn số request đồng thời),
+    cache token ra đĩa, refresh qua /api/auth/refresh trước khi hết hạn.
+    """
+
+    LOGIN_PATH = "/api/auth/login"
+    REFRESH_PATH = "/api/auth/refresh"
+
+    def __init__(
+        self,
+        base_url: str,
+        cache_path: Optional[str] = "tokens.json",
+        concurrency: int = 20,
+        refresh_ahead: float = 120.0,
+        check_interval: float = 30.0,
+    ):
+        self.base_url = base_url
+        self.cache_path = cache_path
+        self.concurrency = concurrency
+        self.refresh_ahead = refresh_ahead
+        self.check_interval = check_interval
+        self.sessions: Dict[str, DriverSession] = {}
+        self.logins = 0
+        self.refreshes = 0
+        self.failures = 0
+        # Chỉ process tạo pool mới ghi file cache, worker process chỉ giữ token trong bộ nhớ
+        self._owner_pid = os.getpid()
+        self._transport: Optional[HttpTransport] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._by_token: Optional[Dict[str, DriverSession]] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+    @property
+    def transport(self) -> HttpTransport:
+        if self._transport is None:
+            self._transport = HttpTransport(limit=self.concurrency, limit_per_host=self.concurrency)
+        return self._transport
+
+    def _load_cache(self) -> Dict[str, Dict]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Ignoring token cache {self.cache_path}: {e}")
+            return {}
+
+    def save(self):
+        if not self.cache_path or os.getpid() != self._owner_pid:
+            return
+        data = {
+            username: {"accessToken": session.access_token, "refreshToken": session.refresh_token}
+            for username, session in self.sessions.items()
+            if session.access_token
+        }
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.cache_path)
+
+    async def login_all(self, credentials: List[Tuple[str, str]]) -> List[DriverSession]:
+        """Dùng lại token trong cache nếu còn hạn, còn lại refresh hoặc login; trả về các session hợp lệ"""
+        cached = self._load_cache()
+        sessions = []
+        for username, password in credentials:
+            session = self.sessions.get(username) or DriverSession(username, password)
+            tokens = cached.get(username, {})
+            if tokens.get("accessToken") and not session.access_token:
+                session.set_access_token(tokens["accessToken"], self.refresh_ahead)
+                session.refresh_token = tokens.get("refreshToken")
+            self.sessions[username] = session
+            sessions.append(session)
+
+        await asyncio.gather(*(self.refresh(session, session.access_token) for session in sessions if session.needs_refresh()))
+        self.save()
+        valid = [session for session in sessions if session.access_token]
+        print(f"🔑 {len(valid)}/{len(sessions)} drivers authenticated ({self.logins} logins, {self.refreshes} refreshes)")
+        return valid
+
+    def session_for(self, access_token: str) -> Optional[DriverSession]:
+        if self._by_token is None:
+            self._by_token = {session.access_token: session for session in self.sessions.values()}
+        return self._by_token.get(access_token)
+
+    async def refresh(self, session: DriverSession, stale: Optional[str]) -> Optional[str]:
+        """
+        Lấy access token mới thay cho stale (refresh, thất bại thì login lại).
+        Các lời gọi đồng thời cho cùng tài khoản chỉ gửi một request.
+        """
+        lock = self._locks.setdefault(session.username, asyncio.Lock())
+        async with lock:
+            if session.access_token != stale and not session.needs_refresh():
+                return session.access_token
+
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.concurrency)
+            async with self._slots:
+                ok = session.can_refresh() and await self._refresh(session)
+                if not ok:
+                    ok = await self._login(session)
+            if not ok:
+                self.failures += 1
+                return None
+            self._by_token = None
+            return session.access_token
+
+    async def _post(self, path: str, payload: Dict) -> Optional[Dict]:
+        try:
+            status, data = await self.transport.request("POST", f"{self.base_url}{path}", json=payload, endpoint=path)
+        except Exception as e:
+            event_log.error("Exception calling %s: %s", path, e)
+            return None
+        if status != 200:
+            event_log.warning("❌ %s failed: %s", path, status)
+            return None
+        return (data or {}).get("data")
+
+    async def _login(self, session: DriverSession) -> bool:
+        data = await self._post(self.LOGIN_PATH, {"username": session.username, "password": session.password})
+        if not data or not data.get("accessToken"):
+            return False
+        self.logins += 1
+        session.set_access_token(data["accessToken"], self.refresh_ahead)
+        session.refresh_token = data.get("refreshToken")
+        return True
+
+    async def _refresh(self, session: DriverSession) -> bool:
+        data = await self._post(self.REFRESH_PATH, {"refreshToken": session.refresh_token})
+        if not data or not data.get("accessToken"):
+            return False
+        self.refreshes += 1
+        session.set_access_token(data["accessToken"], self.refresh_ahead)
+        return True
+
+    async def _keep_fresh(self):
+        """Refresh nền các token sắp hết hạn để request không phải chờ 401"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            due = [session for session in self.sessions.values() if session.needs_refresh()]
+            if due:
+                await asyncio.gather(*(self.refresh(session, session.access_token) for session in due))
+                self.save()
+
+    def start(self):
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._keep_fresh())
+
+    async def close(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+        self.save()
+        if self._transport is not None:
+            await self._transport.close()
+            self._transport = None
+        # Lock và semaphore gắn với event loop hiện tại
+        self._slots = None
+        self._locks = {}
+
+    def report(self) -> str:
+        return f"🔑 Tokens: {self.logins} logins, {self.refreshes} refreshes, {self.failures} failures"
+
+    def __getstate__(self):
+        state = {
+            key: getattr(self, key)
+            for key in ("base_url", "cache_path", "concurrency", "refresh_ahead", "check_interval")
+        }
+        state["sessions"] = self.sessions
+        state["owner_pid"] = self._owner_pid
+        return state
+
+    def __setstate__(self, state):
+        sessions, owner_pid = state.pop("sessions"), state.pop("owner_pid")
+        self.__init__(**state)
+        self.sessions = sessions
+        self._owner_pid = owner_pid
+
+
+def load_accounts(path: str) -> List[Tuple[str, str]]:
+    """Đọc file CSV username,password (bỏ qua dòng trống và dòng bắt đầu bằng #)"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [
+            (row[0].strip(), row[1].strip())
+            for row in csv.reader(f)
+            if len(row) >= 2 and row[0].strip() and not row[0].startswith("#")
+        ]
+
+
+def scheduled_perf_counter(loop: asyncio.AbstractEventLoop, scheduled: float) -> float:
+    """Đổi thời điểm theo loop.time() sang time.perf_counter()"""
+    return time.perf_counter() - (loop.time() - scheduled)
+
+
+LOCATION_PATH = "/api/drivers/trip/{trip_id}/location"
+
+
+def encode_location(latitude: float, longitude: float) -> bytes:
+    """Encode body cập nhật vị trí thành bytes, bằng orjson nếu có (nhanh hơn json.dumps mà aiohttp dùng)"""
+    payload = {"latitude": latitude, "longitude": longitude}
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
 
 class BusSimulator:
-    def __init__(self, access_token: str, base_url: str = "http://localhost:3000"):
+    def __init__(
+        self,
+        access_token: str,
+        base_url: str = "http://localhost:3000",
+        transport: Optional[HttpTransport] = None,
+        use_socket: bool = False,
+        motion: Optional[MotionConfig] = None,
+        cache: Optional[LookupCache] = None,
+        open_loop: Optional[OpenLoopSender] = None,
+        token_pool: Optional[TokenPool] = None,
+        clock: Optional[Clock] = None,
+        socket_ack_timeout: Optional[float] = 5.0,
+    ):
         self.access_token = access_token
         self.base_url = base_url
         self.headers = {
@@ -13,174 +1752,278 @@ class BusSimulator:
             "Content-Type": "application/json"
         }
         self.current_trip = None
+        # Các trip đang chạy của driver này (nhiều trip có thể chồng giờ nhau)
+        self.active_trips: set = set()
+        # Task của từng trip do scheduler trong run_continuous_simulation khởi chạy, theo trip_id
+        self.trip_tasks: Dict[str, asyncio.Task] = {}
+        # Trip đã start trên server trong ngày (theo clock), không chạy lại dù lịch vẫn báo PLANNED/ONGOING
+        self.started_trips: set = set()
+        self._trips_day: Optional[date] = None
         self.is_running = False
+        self.motion = motion or MotionConfig()
+        self.cache = cache
+        # Mọi lần chờ trong simulation đi qua clock để có thể nén thời gian hoặc chạy discrete-event
+        self.clock = clock or Clock()
+        # Khi có, vị trí được gửi theo lịch mà không chờ response (open-loop)
+        self.open_loop = open_loop
+        # Khi có, token được refresh trước khi hết hạn và request bị 401 được thử lại một lần sau khi refresh
+        self.token_pool = token_pool
+        self.session = token_pool.session_for(access_token) if token_pool is not None else None
+        # Định danh ổn định của driver (token đổi sau mỗi lần refresh)
+        self.identity = self.session.username if self.session is not None else access_token
+        # Vị trí mới nhất của từng trip bị bỏ khi circuit breaker của endpoint vị trí đang mở, gửi bù trước khi kết thúc trip
+        self.pending_locations: Dict[str, Tuple[float, float]] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        # Nếu không được truyền transport dùng chung thì simulator tự sở hữu một pool riêng
+        self._owns_transport = transport is None
+        self.transport = transport or HttpTransport()
+        if self._owns_transport:
+            self.transport.clock = self.clock
+        # Khi bật, vị trí và các sự kiện trong chuyến đi được gửi qua socket thay vì HTTP
+        self.socket = (
+            SocketTransport(base_url, access_token, self.transport.stats, ack_timeout=socket_ack_timeout)
+            if use_socket else None
+        )
+        if self.socket is not None:
+            self.socket.clock = self.clock
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        json: Optional[Dict] = None,
+        intended: Optional[float] = None,
+        body: Optional[bytes] = None,
+        **params,
+    ) -> Tuple[int, Optional[Dict]]:
+        """
+        path là template (vd. /api/drivers/trip/{trip_id}/location), dùng luôn làm tên endpoint khi thống kê.
+        body: JSON đã encode sẵn thay cho json
+        """
+        self._sync_token()
+        url = f"{self.base_url}{path.format(**params)}"
+        slots = self._bus_slots()
+        status, data = await self.transport.request(
+            method, url, headers=self.headers, json=json, endpoint=path, intended=intended, bus_slots=slots, body=body
+        )
+        if status == 401 and await self._reauthenticate():
+            status, data = await self.transport.request(
+                method, url, headers=self.headers, json=json, endpoint=path, intended=intended, bus_slots=slots, body=body
+            )
+        return status, data
+
+    def _bus_slots(self) -> Optional[asyncio.Semaphore]:
+        """Giới hạn in-flight riêng của xe này, theo FlowControl của transport"""
+        if self._slots is None and self.transport.flow is not None:
+            self._slots = asyncio.Semaphore(self.transport.flow.per_bus)
+        return self._slots
+
+    async def _cached_get(self, path: str, private: bool = False, transform=None, **params) -> Tuple[int, Optional[Dict]]:
+        """
+        GET qua LookupCache (nếu có); private = dữ liệu riêng của driver nên key gồm cả token.
+        transform(body) chạy một lần cho mỗi body mới, kết quả của nó được cache và trả về.
+        """
+        if self.cache is None:
+            status, data = await self._request("GET", path, **params)
+            if status == 200 and transform is not None:
+                data = transform(data)
+            return status, data
+
+        self._sync_token()
+        url = f"{self.base_url}{path.format(**params)}"
+        key = self._cache_key(url, private)
+
+        async def fetch(etag: Optional[str]):
+            return await self.transport.conditional_get(url, self.headers, etag, endpoint=path, bus_slots=self._bus_slots())
+
+        status, data = await self.cache.get(key, self.cache.ttl_for(path), fetch, transform)
+        if status == 401 and await self._reauthenticate():
+            status, data = await self.cache.get(key, self.cache.ttl_for(path), fetch, transform)
+        return status, data
+
+    def _cache_key(self, url: str, private: bool) -> str:
+        return f"{self.identity}|{url}" if private else url
+
+    def _invalidate(self, path: str, private: bool = False, **params):
+        """Bỏ bản cache của một GET để lần đọc sau lấy dữ liệu mới từ server"""
+        if self.cache is not None:
+            self.cache.invalidate(self._cache_key(f"{self.base_url}{path.format(**params)}", private))
+
+    def _set_token(self, access_token: str):
+        self.access_token = access_token
+        self.headers = {**self.headers, "Authorization": f"Bearer {access_token}"}
+
+    def _sync_token(self):
+        """Dùng token mới nhất nếu TokenPool đã refresh ở nền"""
+        if self.session is not None and self.session.access_token and self.session.access_token != self.access_token:
+            self._set_token(self.session.access_token)
+
+    async def _reauthenticate(self) -> bool:
+        """Refresh token sau khi bị 401, trả về True nếu nên thử lại request"""
+        if self.session is None:
+            return False
+        access_token = await self.token_pool.refresh(self.session, self.access_token)
+        if not access_token:
+            return False
+        self._set_token(access_token)
+        return True
+
+    async def _emit(self, event: str, *data, intended: Optional[float] = None, ack: bool = True) -> bool:
+        try:
+            return await self.socket.emit(event, *data, intended=intended, ack=ack)
+        except Exception as e:
+            event_log.error("Exception emitting %s: %s", event, e)
+            return False
+
+    async def close(self):
+        """Đóng transport nếu simulator sở hữu nó"""
+        if self.socket is not None:
+            await self.socket.close()
+        if self._owns_transport:
+            await self.transport.close()
         
     async def get_today_schedules(self) -> List[Dict]:
         """Lấy lịch trình hôm nay"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(
-                    f"{self.base_url}/api/drivers/schedules/today",
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get("data", {}).get("data", [])
-                    else:
-                        print(f"Error getting schedules: {response.status}")
-                        return []
-            except Exception as e:
-                print(f"Exception getting schedules: {e}")
+        try:
+            status, data = await self._cached_get("/api/drivers/schedules/today", private=True)
+            if status == 200:
+                return data.get("data", {}).get("data", [])
+            else:
+                event_log.warning("Error getting schedules: %s", status)
                 return []
+        except Exception as e:
+            event_log.error("Exception getting schedules: %s", e)
+            return []
     
-    async def get_trip_detail(self, trip_id: str) -> Optional[Dict]:
+    async def get_trip_detail(self, trip_id: str) -> Optional[Trip]:
         """Lấy chi tiết trip"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(
-                    f"{self.base_url}/api/drivers/trip/{trip_id}",
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get("data")
-                    else:
-                        print(f"Error getting trip detail: {response.status}")
-                        return None
-            except Exception as e:
-                print(f"Exception getting trip detail: {e}")
+        try:
+            parse = self.cache.parse_trip if self.cache is not None else lambda data: Trip.from_json(data.get("data"))
+            status, trip = await self._cached_get("/api/drivers/trip/{trip_id}", transform=parse, trip_id=trip_id)
+            if status == 200:
+                return trip
+            else:
+                event_log.warning("Error getting trip detail: %s", status)
                 return None
+        except Exception as e:
+            event_log.error("Exception getting trip detail: %s", e)
+            return None
     
     # Events
     async def start_trip(self, trip_id: str) -> bool:
         """Bắt đầu trip"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(
-                    f"{self.base_url}/api/drivers/trip/{trip_id}/start",
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        print(f"✅ Trip {trip_id} started successfully")
-                        return True
-                    else:
-                        print(f"❌ Error starting trip: {response.status}")
-                        return False
-            except Exception as e:
-                print(f"Exception starting trip: {e}")
+        if self.socket is not None:
+            # Vào room của trip để server broadcast đúng chỗ, trạng thái trip vẫn đổi qua HTTP
+            await self._emit("joinTripRoom", trip_id, ack=False)
+        try:
+            status, data = await self._request("POST", "/api/drivers/trip/{trip_id}/start", trip_id=trip_id)
+            if status == 200:
+                event_log.info("✅ Trip %s started successfully", trip_id)
+                return True
+            else:
+                event_log.warning("❌ Error starting trip: %s", status)
                 return False
+        except Exception as e:
+            event_log.error("Exception starting trip: %s", e)
+            return False
     
-    async def update_location(self, trip_id: str, latitude: float, longitude: float) -> bool:
+    async def update_location(self, trip_id: str, latitude: float, longitude: float, intended: Optional[float] = None) -> bool:
         """Cập nhật vị trí hiện tại"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                payload = {
-                    "latitude": latitude,
-                    "longitude": longitude
-                }
-                async with session.post(
-                    f"{self.base_url}/api/drivers/trip/{trip_id}/location",
-                    headers=self.headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        return True
-                    else:
-                        print(f"❌ Error updating location: {response.status}")
-                        return False
-            except Exception as e:
-                print(f"Exception updating location: {e}")
+        if self.socket is not None:
+            return await self._emit("UpdateLocation", {"lat": latitude, "lng": longitude}, trip_id, intended=intended)
+        flow = self.transport.flow
+        if flow is not None and flow.breaker(f"POST {LOCATION_PATH}").is_open():
+            # Server đang quá tải: không gửi, chỉ giữ vị trí mới nhất
+            flow.counters["shed"] += 1
+            self.pending_locations[trip_id] = (latitude, longitude)
+            return False
+        self.pending_locations.pop(trip_id, None)
+        try:
+            status, data = await self._request(
+                "POST", LOCATION_PATH, intended=intended, body=encode_location(latitude, longitude), trip_id=trip_id
+            )
+            if status == 200:
+                return True
+            else:
+                event_log.warning("❌ Error updating location: %s", status)
                 return False
+        except Exception as e:
+            event_log.error("Exception updating location: %s", e)
+            return False
     
     async def arrive_stop(self, trip_id: str, stop_id: str) -> bool:
         """Đến điểm dừng"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(
-                    f"{self.base_url}/api/drivers/trip/{trip_id}/stoppoint/{stop_id}/arrive",
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        print(f"🚏 Arrived at stop {stop_id}")
-                        return True
-                    else:
-                        print(f"❌ Error arriving stop: {response.status}")
-                        return False
-            except Exception as e:
-                print(f"Exception arriving stop: {e}")
+        try:
+            status, data = await self._request("POST", "/api/drivers/trip/{trip_id}/stoppoint/{stop_id}/arrive", trip_id=trip_id, stop_id=stop_id)
+            if status == 200:
+                event_log.info("🚏 Arrived at stop %s", stop_id)
+                return True
+            else:
+                event_log.warning("❌ Error arriving stop: %s", status)
                 return False
+        except Exception as e:
+            event_log.error("Exception arriving stop: %s", e)
+            return False
     
     async def depart_stop(self, trip_id: str, stop_id: str) -> bool:
         """Rời điểm dừng"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(
-                    f"{self.base_url}/api/drivers/trip/{trip_id}/stoppoint/{stop_id}/depart",
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        print(f"🚌 Departed from stop {stop_id}")
-                        return True
-                    else:
-                        print(f"❌ Error departing stop: {response.status}")
-                        return False
-            except Exception as e:
-                print(f"Exception departing stop: {e}")
+        try:
+            status, data = await self._request("POST", "/api/drivers/trip/{trip_id}/stoppoint/{stop_id}/depart", trip_id=trip_id, stop_id=stop_id)
+            if status == 200:
+                event_log.info("🚌 Departed from stop %s", stop_id)
+                return True
+            else:
+                event_log.warning("❌ Error departing stop: %s", status)
                 return False
+        except Exception as e:
+            event_log.error("Exception departing stop: %s", e)
+            return False
     
     async def pickup_student(self, trip_id: str, student_id: str) -> bool:
         """Đón học sinh"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(
-                    f"{self.base_url}/api/drivers/trip/{trip_id}/students/{student_id}/pickup",
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        print(f"👦 Picked up student {student_id}")
-                        return True
-                    else:
-                        print(f"❌ Error picking up student: {response.status}")
-                        return False
-            except Exception as e:
-                print(f"Exception picking up student: {e}")
+        try:
+            status, data = await self._request("POST", "/api/drivers/trip/{trip_id}/students/{student_id}/pickup", trip_id=trip_id, student_id=student_id)
+            if status == 200:
+                event_log.info("👦 Picked up student %s", student_id)
+                return True
+            else:
+                event_log.warning("❌ Error picking up student: %s", status)
                 return False
+        except Exception as e:
+            event_log.error("Exception picking up student: %s", e)
+            return False
     
     async def dropoff_student(self, trip_id: str, student_id: str) -> bool:
         """Trả học sinh"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(
-                    f"{self.base_url}/api/drivers/trip/{trip_id}/students/{student_id}/dropoff",
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        print(f"👦 Dropped off student {student_id}")
-                        return True
-                    else:
-                        print(f"❌ Error dropping off student: {response.status}")
-                        return False
-            except Exception as e:
-                print(f"Exception dropping off student: {e}")
+        try:
+            status, data = await self._request("POST", "/api/drivers/trip/{trip_id}/students/{student_id}/dropoff", trip_id=trip_id, student_id=student_id)
+            if status == 200:
+                event_log.info("👦 Dropped off student %s", student_id)
+                return True
+            else:
+                event_log.warning("❌ Error dropping off student: %s", status)
                 return False
+        except Exception as e:
+            event_log.error("Exception dropping off student: %s", e)
+            return False
     
     async def end_trip(self, trip_id: str) -> bool:
         """Kết thúc trip"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(
-                    f"{self.base_url}/api/drivers/trip/{trip_id}/end",
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        print(f"🏁 Trip {trip_id} completed successfully")
-                        return True
-                    else:
-                        print(f"❌ Error ending trip: {response.status}")
-                        return False
-            except Exception as e:
-                print(f"Exception ending trip: {e}")
+        pending = self.pending_locations.pop(trip_id, None)
+        if pending is not None:
+            # Gửi vị trí cuối cùng bị bỏ lúc breaker mở để server có vị trí đúng khi trip kết thúc
+            await self.update_location(trip_id, *pending)
+        try:
+            status, data = await self._request("GET", "/api/drivers/trip/{trip_id}/end", trip_id=trip_id)
+            if status == 200:
+                event_log.info("🏁 Trip %s completed successfully", trip_id)
+                return True
+            else:
+                event_log.warning("❌ Error ending trip: %s", status)
                 return False
+        except Exception as e:
+            event_log.error("Exception ending trip: %s", e)
+            return False
     
     # realtime tracking information
     def calculate_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -218,163 +2061,871 @@ class BusSimulator:
                 await self.dropoff_student(trip_id, student_id)
             
             # Thời gian giữa các học sinh
-            await asyncio.sleep(random.uniform(2, 5))
+            await self.clock.sleep(random.uniform(2, 5))
     
-    async def simulate_trip(self, trip_data: Dict):
+    async def simulate_trip(self, trip: Trip):
         """Giả lập một chuyến đi hoàn chỉnh"""
-        trip_id = trip_data["id"]
-        route = trip_data.get("rotute") or trip_data.get("route")  # Handle typo
-        stops = trip_data.get("stops", [])
+        trip_id = trip.id
+        stops_sorted = trip.stops  # Đã sắp theo sequence
         
-        if not route or not route.get("path"):
-            print(f"❌ No route path found for trip {trip_id}")
+        if not len(trip.path):
+            event_log.warning("❌ No route path found for trip %s", trip_id)
             return
         
-        path = route["path"]  # List[Tuple[longitude, latitude]]
-        
-        print(f"🚌 Starting simulation for trip {trip_id}")
-        print(f"📍 Route: {route['name']}")
-        print(f"🛣️  Path points: {len(path)}")
-        print(f"🚏 Stops: {len(stops)}")
+        event_log.info("🚌 Starting simulation for trip %s", trip_id)
+        event_log.info("📍 Route: %s", trip.route_name)
+        event_log.info("🛣️  Path points: %s", len(trip.path))
+        event_log.info("🚏 Stops: %s", len(stops_sorted))
         
         # Bắt đầu trip
         if not await self.start_trip(trip_id):
             return
+        self.started_trips.add(trip_id)
+        self.current_trip = trip_id
+        self.active_trips.add(trip_id)
         
-        # Sắp xếp stops theo sequence
-        stops_sorted = sorted(stops, key=lambda x: x.get("sequence", 0))
+        # Nội suy path thành các điểm GPS theo thời gian (đã gồm thời gian dừng ở các điểm dừng)
+        plan = plan_trip(trip.path, stops_sorted, self.motion, self.clock.seconds_of_day())
+        event_log.info("🕒 Planned %s GPS points over %.1f minutes", len(plan), plan.duration / 60)
         
-        # Di chuyển theo path
-        current_stop_index = 0
+        started = self.clock.time()
+        event_index = 0
+        students_task = None
         
-        for i, point in enumerate(path):
-            longitude, latitude = point
+        for i in range(len(plan)):
+            # Ngủ tới đúng thời điểm của điểm GPS, không cộng dồn sai lệch
+            scheduled = started + plan.time_at(i)
+            await self.clock.sleep_until(scheduled)
+            
+            latitude, longitude = plan.position(i)
             
             # Cập nhật vị trí
-            await self.update_location(trip_id, latitude, longitude)
-            print(f"📍 Location updated: [{latitude:.6f}, {longitude:.6f}] ({i+1}/{len(path)})")
+            if self.open_loop is not None:
+                self.open_loop.submit(
+                    functools.partial(self.update_location, trip_id, latitude, longitude),
+                    self.clock.perf_counter_at(scheduled),
+                    key=trip_id,
+                )
+            else:
+                await self.update_location(trip_id, latitude, longitude)
+            event_log.debug("📍 Location updated: [%.6f, %.6f] (%s/%s)", latitude, longitude, i+1, len(plan))
             
-            # Kiểm tra có gần điểm dừng nào không
-            if current_stop_index < len(stops_sorted):
-                current_stop = stops_sorted[current_stop_index]
-                stop_location = current_stop["location"]  # [longitude, latitude]
+            # Sự kiện đến/rời điểm dừng rơi vào tick này
+            while event_index < len(plan.event_ticks) and plan.event_ticks[event_index] == i:
+                current_stop = stops_sorted[event_index // 2]
                 
-                if self.is_near_stop((longitude, latitude), stop_location):
-                    print(f"🚏 Approaching stop: {current_stop['name']}")
+                if event_index % 2 == 0:
+                    event_log.info("🚏 Approaching stop: %s", current_stop.name)
                     
                     # Đến điểm dừng
-                    await self.arrive_stop(trip_id, current_stop["id"])
-                    
-                    # Dừng lại 30-60 giây
-                    stop_duration = random.uniform(30, 60)
-                    print(f"⏱️  Stopping for {stop_duration:.1f} seconds...")
+                    await self.arrive_stop(trip_id, current_stop.id)
                     
-                    # Giả lập đón/trả học sinh
+                    # Giả lập đón/trả học sinh trong lúc xe vẫn gửi vị trí
                     schedule_type = "DISPATH" if random.choice([True, False]) else "RETURN"
-                    await self.simulate_student_actions(trip_id, schedule_type)
-                    
-                    await asyncio.sleep(stop_duration)
+                    students_task = asyncio.create_task(self.simulate_student_actions(trip_id, schedule_type))
+                else:
+                    if students_task is not None:
+                        await students_task
+                        students_task = None
                     
                     # Rời điểm dừng
-                    await self.depart_stop(trip_id, current_stop["id"])
-                    
-                    current_stop_index += 1
-            
-            # Thời gian di chuyển giữa các điểm (3-8 giây)
-            travel_time = random.uniform(3, 8)
-            await asyncio.sleep(travel_time)
+                    await self.depart_stop(trip_id, current_stop.id)
+                
+                event_index += 1
         
-        # Kết thúc trip
+        # Kết thúc trip, sau khi các vị trí open-loop đã gửi tới server
+        if self.open_loop is not None:
+            await self.open_loop.flush(trip_id)
         await self.end_trip(trip_id)
-        print(f"✅ Trip {trip_id} simulation completed!")
+        # Lịch và chi tiết trip đã cache vẫn mang trạng thái cũ của trip vừa chạy xong
+        self._invalidate("/api/drivers/schedules/today", private=True)
+        self._invalidate("/api/drivers/trip/{trip_id}", trip_id=trip_id)
+        event_log.info("✅ Trip %s simulation completed!", trip_id)
     
+    async def run_scheduled_trip(self, trip_id: str, status: str, start_time: Optional[float]):
+        """Chờ tới giờ xuất phát của trip (trip ONGOING chạy ngay) rồi giả lập nó"""
+        try:
+            # Trip chưa chạy thì chờ tới đúng giờ xuất phát (theo clock)
+            if status == "PLANNED" and start_time is not None and start_time > self.clock.time():
+                event_log.info(
+                    "⏰ Trip %s departs at %s, waiting...",
+                    trip_id, time.strftime("%H:%M", time.localtime(start_time)),
+                )
+                await self.clock.sleep_until(start_time)
+            trip_detail = await self.get_trip_detail(trip_id)
+            if trip_detail:
+                event_log.info("🎯 Selected trip %s for simulation", trip_id)
+                await self.simulate_trip(trip_detail)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            event_log.error("❌ Error simulating trip %s: %s", trip_id, e)
+        finally:
+            # Trip lỗi hoặc bị huỷ giữa chừng cũng không còn chạy nữa
+            self.active_trips.discard(trip_id)
+            self.current_trip = next(iter(self.active_trips), None)
+
+    def schedule_trips(self, schedules: List[Dict]) -> int:
+        """
+        Khởi chạy mỗi trip PLANNED/ONGOING chưa có task và chưa được start hôm nay thành một task riêng,
+        trả về số trip mới được lên lịch. Lịch cache có thể cũ, end_trip có thể lỗi, nên trạng thái
+        từ server không đủ để biết trip đã chạy xong trên simulator hay chưa.
+        """
+        today = datetime.fromtimestamp(self.clock.time()).date()
+        if today != self._trips_day:
+            self._trips_day = today
+            self.started_trips.clear()
+        launched = 0
+        for schedule in sorted(schedules, key=lambda item: schedule_start_time(item, self.clock) or 0.0):
+            trip_id = schedule.get("tripId")
+            status = schedule.get("static", "").upper()
+            trip_type = schedule.get("type", "")
+
+            event_log.debug("🔍 Checking trip %s - Status: %s, Type: %s", trip_id, status, trip_type)
+
+            # Chỉ simulation các trip đang PLANNED hoặc ONGOING
+            if status not in ["PLANNED", "ONGOING"]:
+                event_log.debug("⏭️  Skipping trip %s - Status: %s", trip_id, status)
+                continue
+            if trip_id in self.trip_tasks or trip_id in self.started_trips:
+                continue
+            task = asyncio.create_task(self.run_scheduled_trip(trip_id, status, schedule_start_time(schedule, self.clock)))
+            self.trip_tasks[trip_id] = task
+            task.add_done_callback(lambda _, trip_id=trip_id: self.trip_tasks.pop(trip_id, None))
+            launched += 1
+        return launched
+
     async def run_continuous_simulation(self):
-        """Chạy simulation liên tục"""
+        """
+        Chạy simulation liên tục: mỗi trip trong lịch hôm nay chạy thành một task riêng từ đúng giờ xuất phát,
+        nên các trip chồng giờ của cùng một driver chạy song song; lịch được quét lại mỗi 2 phút
+        """
         self.is_running = True
-        print("🚌 Bus Simulator started!")
+        event_log.info("🚌 Bus Simulator started!")
+        failures = 0
+        # Khi nén thời gian, lịch "hôm nay" chỉ có nghĩa tới hết ngày của clock
+        day_end = self.clock.end_of_day() if self.clock.factor != 1.0 else math.inf
         
-        while self.is_running:
-            try:
-                # Lấy lịch trình hôm nay
-                schedules = await self.get_today_schedules()
-                
-                if not schedules:
-                    print("📅 No schedules found for today. Waiting 60 seconds...")
-                    await asyncio.sleep(60)
-                    continue
-                
-                print(f"📅 Found {len(schedules)} schedules today")
-                
-                # Chọn trip để simulation
-                for schedule in schedules:
-                    trip_id = schedule.get("tripId")
-                    status = schedule.get("static", "").upper()
-                    trip_type = schedule.get("type", "")
-                    start_time = schedule.get("startTime", "")
+        try:
+            while self.is_running and self.clock.time() < day_end:
+                try:
+                    # Lấy lịch trình hôm nay
+                    schedules = await self.get_today_schedules()
                     
-                    print(f"🔍 Checking trip {trip_id} - Status: {status}, Type: {trip_type}")
+                    if not schedules:
+                        event_log.info("📅 No schedules found for today. Waiting 60 seconds...")
+                        await self.clock.sleep(60)
+                        continue
                     
-                    # Chỉ simulation các trip đang PLANNED hoặc ONGOING
-                    if status in ["PLANNED", "ONGOING"]:
-                        trip_detail = await self.get_trip_detail(trip_id)
-                        
-                        if trip_detail:
-                            print(f"🎯 Selected trip {trip_id} for simulation")
-                            await self.simulate_trip(trip_detail)
-                            
-                            # Nghỉ 5 phút giữa các trip
-                            print("⏸️  Waiting 5 minutes before next trip...")
-                            await asyncio.sleep(300)
-                            break
-                    else:
-                        print(f"⏭️  Skipping trip {trip_id} - Status: {status}")
-                
-                # Nếu không có trip nào phù hợp, chờ 2 phút
-                print("⏱️  No suitable trips found. Waiting 2 minutes...")
-                await asyncio.sleep(120)
-                
-            except KeyboardInterrupt:
-                print("\n🛑 Simulation stopped by user")
-                break
-            except Exception as e:
-                print(f"❌ Error in simulation loop: {e}")
-                await asyncio.sleep(30)
-        
-        self.is_running = False
-        print("🔴 Bus Simulator stopped!")
+                    event_log.info("📅 Found %s schedules today", len(schedules))
+                    launched = self.schedule_trips(schedules)
+                    if launched:
+                        event_log.info("🗓️  Scheduled %s trips (%s in progress)", launched, len(self.trip_tasks))
+                    elif not self.trip_tasks:
+                        event_log.info("⏱️  No suitable trips found. Waiting 2 minutes...")
+                    
+                    # Quét lại lịch để bắt các trip mới được thêm trong ngày
+                    await self.clock.sleep(120)
+                    
+                except KeyboardInterrupt:
+                    event_log.info("\n🛑 Simulation stopped by user")
+                    break
+                except Exception as e:
+                    # Backoff có jitter để các xe không cùng lúc dội lại server vừa lỗi
+                    failures += 1
+                    delay = backoff_delay(failures, 5.0, 300.0)
+                    event_log.error("❌ Error in simulation loop: %s (retrying in %.0fs)", e, delay)
+                    await self.clock.sleep(delay)
+                    continue
+                failures = 0
+            
+            # Trip còn chờ giờ xuất phát bị huỷ, trip đã xuất phát được chạy nốt tới khi kết thúc
+            for trip_id, task in list(self.trip_tasks.items()):
+                if trip_id not in self.active_trips:
+                    task.cancel()
+            await asyncio.gather(*self.trip_tasks.values(), return_exceptions=True)
+        finally:
+            for task in list(self.trip_tasks.values()):
+                task.cancel()
+            self.is_running = False
+            await self.close()
+            event_log.info("🔴 Bus Simulator stopped!")
     
     def stop(self):
         """Dừng simulation"""
         self.is_running = False
 
 
+# Fleet engine: một scheduler trung tâm cho hàng nghìn xe
+BUS_START = 0
+BUS_MOVE = 1
+BUS_END = 2
+
+
+class VirtualBus:
+    """Trạng thái tối thiểu của một xe trong FleetEngine"""
+
+    __slots__ = ("simulator", "trip_id", "plan", "stop_ids", "tick", "event_index", "state")
+
+    def __init__(self, simulator: "BusSimulator", trip_id: str, plan: TripPlan, stop_ids: Tuple[str, ...]):
+        self.simulator = simulator
+        self.trip_id = trip_id
+        self.plan = plan
+        self.stop_ids = stop_ids
+        self.tick = 0
+        self.event_index = 0
+        self.state = BUS_START
+
+
+class FleetEngine:
+    """Chạy nhiều xe trên một event loop bằng heap các thời điểm sự kiện kế tiếp"""
+
+    def __init__(
+        self,
+        motion: Optional[MotionConfig] = None,
+        max_in_flight: int = 500,
+        report_interval: float = 10.0,
+        open_loop: Optional[OpenLoopSender] = None,
+    ):
+        self.motion = motion or MotionConfig()
+        self.report_interval = report_interval
+        # Khi có, vị trí được gửi đúng lịch dù server chậm thay vì chặn scheduler ở giới hạn in-flight
+        self.open_loop = open_loop
+        self.is_running = False
+        self.events = 0
+        self.active = 0
+        self._heap: List[Tuple[float, int, VirtualBus]] = []
+        self._seq = itertools.count()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight = set()
+        self._started_at = 0.0
+        # Độ trễ giữa thời điểm sự kiện đến hạn và lúc scheduler thực sự xử lý (tick jitter)
+        self.tick_lag = LatencyHistogram()
+
+    def add_trip(
+        self,
+        simulator: "BusSimulator",
+        trip: Trip,
+        start_delay: float = 0.0,
+        plan: Optional[TripPlan] = None,
+    ) -> bool:
+        """Thêm một trip vào engine (plan tính sẵn nếu có), trả về False nếu trip không có path"""
+        if not len(trip.path):
+            event_log.warning("❌ No route path found for trip %s", trip.id)
+            return False
+
+        plan = plan or plan_trip(trip.path, trip.stops, self.motion)
+        # Xe chỉ giữ plan và id điểm dừng, không giữ lại Trip
+        bus = VirtualBus(simulator, trip.id, plan, tuple(stop.id for stop in trip.stops))
+        self._push(bus, self._now() + start_delay)
+        self.active += 1
+        return True
+
+    async def load_from_simulators(self, simulators: List["BusSimulator"], stagger: float = 0.0) -> int:
+        """Lấy các trip PLANNED/ONGOING hôm nay của từng driver và thêm vào engine"""
+
+        async def load(simulator: "BusSimulator") -> List[Trip]:
+            trips = []
+            for schedule in await simulator.get_today_schedules():
+                if schedule.get("static", "").upper() not in ["PLANNED", "ONGOING"]:
+                    continue
+                trip_detail = await simulator.get_trip_detail(schedule.get("tripId"))
+                if trip_detail:
+                    trips.append(trip_detail)
+            return trips
+
+        results = await asyncio.gather(*(load(simulator) for simulator in simulators))
+        added = 0
+        for simulator, trips in zip(simulators, results):
+            for trip_detail in trips:
+                if self.add_trip(simulator, trip_detail, start_delay=added * stagger):
+                    added += 1
+        return added
+
+    def add_route_paths(
+        self,
+        simulators: List["BusSimulator"],
+        route_paths: Dict[str, List],
+        buses: int,
+        stagger: float = 0.1,
+        first: int = 0,
+    ) -> int:
+        """
+        Tạo trip giả lập từ route_paths.json (do t.py crawl) để chạy tải lớn.
+        first: số thứ tự của xe đầu tiên, để các worker chia nhau một đội xe mà id/tuyến/giờ chạy không trùng
+        """
+        routes = [(route_id, path) for route_id, paths in route_paths.items() for path in paths if path]
+        if not routes or not simulators:
+            return 0
+
+        # Trip giả lập không có điểm dừng nên mỗi path chỉ cần nội suy một lần
+        plans: Dict[int, Tuple[np.ndarray, TripPlan]] = {}
+        for i in range(first, first + buses):
+            route_id, path = routes[i % len(routes)]
+            if i % len(routes) not in plans:
+                array = shared_path(path)
+                plans[i % len(routes)] = (array, plan_trip(array, [], self.motion))
+            array, plan = plans[i % len(routes)]
+            trip = Trip(f"sim-{route_id}-{i}", str(route_id), str(route_id), array)
+            self.add_trip(simulators[(i - first) % len(simulators)], trip, start_delay=i * stagger, plan=plan)
+        return buses
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def _push(self, bus: VirtualBus, due: float):
+        heapq.heappush(self._heap, (due, next(self._seq), bus))
+
+    async def _submit(self, coro):
+        """Gửi request ở background, chặn khi đã đạt giới hạn in-flight"""
+        await self._slots.acquire()
+        task = asyncio.create_task(coro)
+        self._in_flight.add(task)
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._slots.release()
+
+    async def _step(self, bus: VirtualBus, due: float) -> Optional[float]:
+        """Xử lý một sự kiện của xe (đến hạn lúc due), trả về thời gian tới sự kiện kế tiếp (None khi xong)"""
+        simulator = bus.simulator
+
+        if bus.state == BUS_START:
+            await self._submit(simulator.start_trip(bus.trip_id))
+            bus.state = BUS_MOVE
+            return 0.0
+
+        if bus.state == BUS_MOVE:
+            plan = bus.plan
+            i = bus.tick
+            latitude, longitude = plan.position(i)
+            if self.open_loop is not None:
+                self.open_loop.submit(
+                    functools.partial(simulator.update_location, bus.trip_id, latitude, longitude),
+                    scheduled_perf_counter(asyncio.get_running_loop(), due),
+                    key=bus.trip_id,
+                )
+            else:
+                await self._submit(simulator.update_location(bus.trip_id, latitude, longitude))
+            event_log.debug("📍 Location sent: trip %s [%.6f, %.6f] (%s/%s)", bus.trip_id, latitude, longitude, i + 1, len(plan))
+
+            while bus.event_index < len(plan.event_ticks) and plan.event_ticks[bus.event_index] == i:
+                stop_id = bus.stop_ids[bus.event_index // 2]
+                if bus.event_index % 2 == 0:
+                    await self._submit(simulator.arrive_stop(bus.trip_id, stop_id))
+                else:
+                    await self._submit(simulator.depart_stop(bus.trip_id, stop_id))
+                bus.event_index += 1
+
+            bus.tick += 1
+            if bus.tick >= len(plan):
+                bus.state = BUS_END
+                return 0.0
+            return plan.interval
+
+        await self._submit(self._end_trip(simulator, bus.trip_id))
+        return None
+
+    async def _end_trip(self, simulator: "BusSimulator", trip_id: str):
+        # Chờ ở background để không chặn scheduler của các xe khác
+        if self.open_loop is not None:
+            await self.open_loop.flush(trip_id)
+        await simulator.end_trip(trip_id)
+
+    def stats(self) -> Dict:
+        elapsed = max(self._now() - self._started_at, 1e-9)
+        return {
+            "events": self.events,
+            "elapsed": elapsed,
+            "events_per_sec": self.events / elapsed,
+            "active_buses": self.active,
+            "in_flight": len(self._in_flight),
+            "tick_lag_p99": self.tick_lag.percentile(99),
+            "tick_lag_max": self.tick_lag.max,
+        }
+
+    def _report(self):
+        s = self.stats()
+        event_log.info(
+            "⚙️  Fleet: %s buses active, %s events, %.1f events/s, %s in flight, tick lag p99 %.1f ms",
+            s["active_buses"], s["events"], s["events_per_sec"], s["in_flight"], s["tick_lag_p99"] * 1000,
+        )
+
+    async def run(self):
+        """Vòng lặp scheduler: ngủ tới sự kiện gần nhất rồi xử lý mọi sự kiện đến hạn"""
+        self.is_running = True
+        self._started_at = self._now()
+        next_report = self._started_at + self.report_interval
+        event_log.info("🚌 Fleet engine started with %s buses", self.active)
+
+        try:
+            while self.is_running and self._heap:
+                now = self._now()
+                if now >= next_report:
+                    self._report()
+                    next_report = now + self.report_interval
+
+                due = self._heap[0][0]
+                if due > now:
+                    await asyncio.sleep(min(due, next_report) - now)
+                    continue
+
+                processed = 0
+                while self._heap and self._heap[0][0] <= now:
+                    due, _, bus = heapq.heappop(self._heap)
+                    self.tick_lag.record(self._now() - due)
+                    delay = await self._step(bus, due)
+                    self.events += 1
+                    if delay is None:
+                        self.active -= 1
+                    else:
+                        # Lịch tính từ thời điểm dự kiến, không bị trôi khi scheduler xử lý trễ
+                        self._push(bus, due + delay)
+
+                    # Nhường event loop để các request kịp chạy
+                    processed += 1
+                    if processed % 256 == 0:
+                        await asyncio.sleep(0)
+
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+            if self.open_loop is not None:
+                await self.open_loop.drain()
+        finally:
+            self.is_running = False
+            self._report()
+            event_log.info("🔴 Fleet engine stopped!")
+
+    def stop(self):
+        """Dừng engine"""
+        self.is_running = False
+
+
+class FleetOptions:
+    """Cấu hình dùng chung cho mọi simulator của một lần chạy (pickle được để gửi sang worker process)"""
+
+    def __init__(
+        self,
+        use_socket: bool = False,
+        motion: Optional[MotionConfig] = None,
+        open_loop: bool = False,
+        max_in_flight: int = 100,
+        max_backlog: int = 10000,
+        token_pool: Optional[TokenPool] = None,
+        console_level: int = INFO,
+        log_path: Optional[str] = None,
+        dashboard: bool = False,
+        flow: Optional[FlowControl] = None,
+        clock: Optional[Clock] = None,
+        socket_ack_timeout: Optional[float] = 5.0,
+    ):
+        self.use_socket = use_socket
+        # None: socket emit không chờ ack
+        self.socket_ack_timeout = socket_ack_timeout
+        self.motion = motion or MotionConfig()
+        self.open_loop = open_loop
+        self.max_in_flight = max_in_flight
+        self.max_backlog = max_backlog
+        self.token_pool = token_pool
+        # Dashboard thay thế log console; log đầy đủ (nếu cần) ghi ra log_path
+        self.console_level = console_level
+        self.log_path = log_path
+        self.dashboard = dashboard
+        # Pickle chỉ giữ cấu hình nên mỗi worker process có bộ đếm/breaker/semaphore riêng
+        self.flow = flow
+        self.clock = clock or Clock()
+
+    def start_console(self, stats: RequestStats, active_trips: Callable[[], int], shard: Optional[int] = None):
+        """Bật ghi log theo lô và dashboard 1 Hz (nếu chọn), trả về task dashboard"""
+        path = self.log_path if shard is None or not self.log_path else f"{self.log_path}.{shard}"
+        # Worker không vẽ dashboard (coordinator in số liệu gộp) nhưng vẫn tắt log console giống process đơn
+        event_log.configure(None if self.dashboard else self.console_level, path)
+        event_log.start()
+        if self.dashboard and shard is None:
+            return asyncio.create_task(Dashboard(stats, active_trips).run())
+        return None
+
+    @staticmethod
+    async def stop_console(dashboard_task: Optional[asyncio.Task]):
+        if dashboard_task is not None:
+            dashboard_task.cancel()
+            await asyncio.gather(dashboard_task, return_exceptions=True)
+        await event_log.close()
+
+    def new_open_loop(self) -> Optional[OpenLoopSender]:
+        return OpenLoopSender(self.max_in_flight, self.max_backlog) if self.open_loop else None
+
+    def new_simulator(
+        self,
+        token: str,
+        base_url: str,
+        transport: Optional[HttpTransport] = None,
+        cache: Optional[LookupCache] = None,
+        open_loop: Optional[OpenLoopSender] = None,
+    ) -> "BusSimulator":
+        return BusSimulator(
+            token, base_url, transport, self.use_socket, self.motion, cache, open_loop, self.token_pool, self.clock,
+            self.socket_ack_timeout,
+        )
+
+
+def print_run_summary(
+    cache: LookupCache,
+    open_loop: Optional[OpenLoopSender],
+    token_pool: Optional[TokenPool] = None,
+    flow: Optional[FlowControl] = None,
+):
+    print(cache.report())
+    if open_loop is not None:
+        print(open_loop.report())
+    if token_pool is not None:
+        print(token_pool.report())
+    if flow is not None:
+        print(flow.report())
+
+
 # Hàm chạy simulation với nhiều token
-async def run_multiple_simulators(tokens: List[str], base_url: str = "http://localhost:3000"):
+async def run_multiple_simulators(
+    tokens: List[str],
+    base_url: str = "http://localhost:3000",
+    transport: Optional[HttpTransport] = None,
+    metrics_prefix: Optional[str] = None,
+    metrics_interval: float = 60.0,
+    options: Optional[FleetOptions] = None,
+):
     """Chạy nhiều simulator cùng lúc với các token khác nhau"""
     
-    simulators = [BusSimulator(token, base_url) for token in tokens]
+    # Tất cả simulator dùng chung một connection pool và cache lịch trình/trip
+    options = options or FleetOptions()
+    transport = transport or HttpTransport()
+    transport.flow = transport.flow or options.flow
+    transport.clock = options.clock
+    cache = LookupCache(clock=options.clock)
+    open_loop = options.new_open_loop()
+    simulators = [options.new_simulator(token, base_url, transport, cache, open_loop) for token in tokens]
+    token_pool = options.token_pool
+    if token_pool is not None:
+        token_pool.start()
+    dashboard_task = options.start_console(
+        transport.stats, lambda: sum(len(simulator.active_trips) for simulator in simulators)
+    )
+    dump_task = None
+    if metrics_prefix:
+        dump_task = asyncio.create_task(dump_stats_periodically(transport.stats, metrics_prefix, metrics_interval))
     
     # Chạy tất cả simulator song song
     tasks = []
     for i, simulator in enumerate(simulators):
-        print(f"🚌 Starting simulator {i+1} with token: {simulator.access_token[:20]}...")
+        event_log.info("🚌 Starting simulator %s with token: %s...", i + 1, simulator.access_token[:20])
         task = asyncio.create_task(simulator.run_continuous_simulation())
         tasks.append(task)
         
-        # Stagger start time để tránh conflict
-        await asyncio.sleep(10)
+        # Stagger start time để tránh conflict (theo clock của simulation)
+        await options.clock.sleep(10)
     
     try:
         # Chờ tất cả tasks hoàn thành
         await asyncio.gather(*tasks)
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         print("\n🛑 Stopping all simulators...")
         for simulator in simulators:
             simulator.stop()
+    finally:
+        for simulator in simulators:
+            await simulator.close()
+        if open_loop is not None:
+            await open_loop.drain()
+        if token_pool is not None:
+            await token_pool.close()
+        await transport.close()
+        await options.stop_console(dashboard_task)
+        print_run_summary(cache, open_loop, token_pool, transport.flow)
+        await finish_stats(transport.stats, metrics_prefix, dump_task)
+
+
+async def run_fleet(
+    tokens: List[str],
+    base_url: str = "http://localhost:3000",
+    transport: Optional[HttpTransport] = None,
+    route_paths_file: Optional[str] = None,
+    buses: int = 0,
+    metrics_prefix: Optional[str] = None,
+    metrics_interval: float = 60.0,
+    options: Optional[FleetOptions] = None,
+):
+    """Chạy toàn bộ đội xe trên một FleetEngine duy nhất"""
+    options = options or FleetOptions()
+    transport = transport or HttpTransport()
+    transport.flow = transport.flow or options.flow
+    transport.clock = options.clock
+    cache = LookupCache(clock=options.clock)
+    open_loop = options.new_open_loop()
+    simulators = [options.new_simulator(token, base_url, transport, cache, open_loop) for token in tokens]
+    token_pool = options.token_pool
+    if token_pool is not None:
+        token_pool.start()
+    engine = FleetEngine(options.motion, open_loop=open_loop)
+    dashboard_task = options.start_console(transport.stats, lambda: engine.active)
+    dump_task = None
+    if metrics_prefix:
+        dump_task = asyncio.create_task(dump_stats_periodically(transport.stats, metrics_prefix, metrics_interval))
+
+    try:
+        if route_paths_file:
+            with open(route_paths_file, "r", encoding="utf-8") as f:
+                route_paths = json.load(f)
+            engine.add_route_paths(simulators, route_paths, buses)
+        else:
+            await engine.load_from_simulators(simulators)
+
+        await engine.run()
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("\n🛑 Stopping fleet engine...")
+        engine.stop()
+    finally:
+        for simulator in simulators:
+            await simulator.close()
+        if open_loop is not None:
+            await open_loop.drain()
+        if token_pool is not None:
+            await token_pool.close()
+        await transport.close()
+        await options.stop_console(dashboard_task)
+        print_run_summary(cache, open_loop, token_pool, transport.flow)
+        await finish_stats(transport.stats, metrics_prefix, dump_task)
+
+
+# Chế độ đa process: chia token cho nhiều worker, mỗi worker một event loop
+async def _shard_main(
+    shard: int,
+    tokens: List[str],
+    base_url: str,
+    mode: str,
+    stats_queue,
+    stop_event,
+    report_interval: float,
+    options: FleetOptions,
+    route_paths_file: Optional[str] = None,
+    buses: int = 0,
+    first_bus: int = 0,
+):
+    transport = HttpTransport()
+    transport.flow = options.flow
+    transport.clock = options.clock
+    cache = LookupCache(clock=options.clock)
+    open_loop = options.new_open_loop()
+    simulators = [options.new_simulator(token, base_url, transport, cache, open_loop) for token in tokens]
+    engine = FleetEngine(options.motion, report_interval=report_interval, open_loop=open_loop) if mode == "fleet" else None
+    token_pool = options.token_pool
+    if token_pool is not None:
+        token_pool.start()
+    options.start_console(transport.stats, lambda: 0, shard)
+
+    if engine is not None:
+        if route_paths_file:
+            with open(route_paths_file, "r", encoding="utf-8") as f:
+                route_paths = json.load(f)
+            engine.add_route_paths(simulators, route_paths, buses, first=first_bus)
+        else:
+            await engine.load_from_simulators(simulators)
+        runner = asyncio.create_task(engine.run())
+    else:
+        runner = asyncio.gather(*(simulator.run_continuous_simulation() for simulator in simulators))
+
+    def snapshot() -> Dict:
+        data = transport.stats.to_dict()
+        data["shard"] = shard
+        data["events"] = engine.events if engine is not None else data["requests"]
+        return data
+
+    try:
+        while not runner.done() and not stop_event.is_set():
+            await asyncio.wait({runner}, timeout=report_interval)
+            stats_queue.put(snapshot())
+    finally:
+        if engine is not None:
+            engine.stop()
+        for simulator in simulators:
+            simulator.stop()
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        for simulator in simulators:
+            await simulator.close()
+        if open_loop is not None:
+            await open_loop.drain()
+        if token_pool is not None:
+            await token_pool.close()
+        await transport.close()
+        await options.stop_console(None)
+        stats_queue.put(snapshot())
+
+
+def _shard_worker(
+    shard: int,
+    tokens: List[str],
+    base_url: str,
+    mode: str,
+    stats_queue,
+    stop_event,
+    report_interval: float,
+    options: FleetOptions,
+    route_paths_file: Optional[str] = None,
+    buses: int = 0,
+    first_bus: int = 0,
+):
+    # Ctrl-C do coordinator xử lý, worker chỉ dừng khi stop_event được set
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_shard_main(
+        shard, tokens, base_url, mode, stats_queue, stop_event, report_interval, options,
+        route_paths_file, buses, first_bus,
+    ))
+
+
+def run_sharded(
+    tokens: List[str],
+    base_url: str = "http://localhost:3000",
+    workers: int = 0,
+    mode: str = "continuous",
+    report_interval: float = 10.0,
+    metrics_prefix: Optional[str] = None,
+    options: Optional[FleetOptions] = None,
+    route_paths_file: Optional[str] = None,
+    buses: int = 0,
+):
+    """
+    Chia danh sách token cho nhiều process và gộp thống kê từ tất cả worker.
+    Với route_paths_file (fleet mode), mỗi worker chạy buses // workers xe giả lập, phần dư cho worker 0.
+    """
+    options = options or FleetOptions()
+    workers = min(workers or mp.cpu_count(), len(tokens))
+    stats_queue = mp.Queue()
+    stop_event = mp.Event()
+    latest: Dict[int, Dict] = {}
+
+    shard_buses = [buses // workers + (buses % workers if i == 0 else 0) for i in range(workers)]
+    first_bus = [sum(shard_buses[:i]) for i in range(workers)]
+    processes = [
+        mp.Process(
+            target=_shard_worker,
+            args=(
+                i, tokens[i::workers], base_url, mode, stats_queue, stop_event, report_interval, options,
+                route_paths_file, shard_buses[i], first_bus[i],
+            ),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    print(f"🧩 Started {workers} worker processes")
+
+    started = time.monotonic()
+
+    def drain(timeout: float):
+        try:
+            snapshot = stats_queue.get(timeout=timeout)
+            latest[snapshot["shard"]] = snapshot
+            while True:
+                snapshot = stats_queue.get_nowait()
+                latest[snapshot["shard"]] = snapshot
+        except Exception:
+            pass
+
+    def report() -> RequestStats:
+        total = RequestStats.merge_all(list(latest.values()))
+        summary = total.to_dict()
+        events = sum(snapshot["events"] for snapshot in latest.values())
+        elapsed = max(time.monotonic() - started, 1e-9)
+        avg = summary["latency_sum"] / summary["requests"] * 1000 if summary["requests"] else 0.0
+        print(
+            f"🧩 {len(latest)}/{workers} workers: {summary['requests']} requests "
+            f"({summary['requests'] / elapsed:.1f} req/s), {summary['errors']} errors, "
+            f"{events} events, latency avg {avg:.1f} ms / max {summary['latency_max'] * 1000:.1f} ms"
+        )
+        if metrics_prefix:
+            total.dump(metrics_prefix)
+        return total
+
+    try:
+        while any(process.is_alive() for process in processes):
+            drain(report_interval)
+            report()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping all workers...")
+    finally:
+        stop_event.set()
+        deadline = time.monotonic() + 10
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.terminate()
+        drain(0.1)
+        report().print_report()
 
 
 # Main execution
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bus Route Simulator")
+    parser.add_argument("--mode", choices=["continuous", "fleet"], default="continuous",
+                        help="continuous: mỗi driver một task; fleet: một scheduler cho cả đội xe")
+    parser.add_argument("--route-paths", help="route_paths.json (từ t.py) để tạo trip giả lập cho fleet mode (cần --synthetic)")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Cho phép trip giả lập \"sim-<route>-<i>\": server thật không có các trip này (trả 404), "
+                             "chỉ dùng với stub hoặc server đã seed sẵn")
+    parser.add_argument("--buses", type=int, default=1000, help="Số xe giả lập khi dùng --route-paths")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Số process (0 = số CPU); > 1 thì chia token cho nhiều worker")
+    parser.add_argument("--transport", choices=["http", "socket"], default="http",
+                        help="socket: stream vị trí qua một socket.io cho mỗi xe (các sự kiện khác vẫn qua HTTP)")
+    parser.add_argument("--socket-ack-timeout", type=float, default=5.0,
+                        help="Thời gian chờ ack của UpdateLocation (giây); 0 = không chờ ack, thống kê dưới tên riêng")
+    parser.add_argument("--gps-interval", type=float, default=5.0, help="Chu kỳ gửi vị trí (giây)")
+    parser.add_argument("--speed", type=float, default=25.0, help="Vận tốc trung bình (km/h)")
+    parser.add_argument("--speed-by-hour", default="",
+                        help="Vận tốc theo giờ, vd. \"6:18,7:15,16:15,17:15\" (giờ không liệt kê dùng --speed)")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Nén thời gian: 60 = một giờ simulation chạy trong một phút (continuous mode)")
+    parser.add_argument("--discrete", action="store_true",
+                        help="Chạy discrete-event: thời gian nhảy tới sự kiện kế tiếp, không chờ thật (continuous mode)")
+    parser.add_argument("--clock-start", help="Giờ bắt đầu của simulation, \"HH:MM\" hôm nay hoặc ISO datetime")
+    parser.add_argument("--open-loop", action="store_true",
+                        help="Gửi vị trí đúng lịch không chờ response, độ trễ tính từ thời điểm dự kiến gửi")
+    parser.add_argument("--max-in-flight", type=int, default=100, help="Số request vị trí đang chạy tối đa (open-loop)")
+    parser.add_argument("--max-backlog", type=int, default=10000,
+                        help="Số request vị trí chờ gửi tối đa, vượt quá thì bỏ (open-loop)")
+    parser.add_argument("--accounts", help="CSV username,password của các driver; đăng nhập tự động thay cho ACCESS_TOKENS")
+    parser.add_argument("--token-cache", default="tokens.json", help="File cache token khi dùng --accounts")
+    parser.add_argument("--login-concurrency", type=int, default=20, help="Số request login/refresh đồng thời tối đa")
+    parser.add_argument("--flow-control", action="store_true",
+                        help="Bật giới hạn in-flight, retry có backoff + jitter và circuit breaker theo endpoint")
+    parser.add_argument("--fleet-in-flight", type=int, default=1000, help="Số request đang chạy tối đa của cả đội xe")
+    parser.add_argument("--bus-in-flight", type=int, default=4, help="Số request đang chạy tối đa của mỗi xe")
+    parser.add_argument("--max-retries", type=int, default=3, help="Số lần retry tối đa cho request idempotent")
+    parser.add_argument("--breaker-threshold", type=int, default=5,
+                        help="Số lỗi quá tải liên tiếp để mở circuit breaker của một endpoint")
+    parser.add_argument("--breaker-reset", type=float, default=10.0, help="Thời gian breaker mở trước khi thử lại (giây)")
+    parser.add_argument("--dashboard", action="store_true",
+                        help="Hiện bảng tổng hợp cập nhật mỗi giây thay cho log từng sự kiện")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default="info", help="Mức log in ra console")
+    parser.add_argument("--log-file", help="Ghi log đầy đủ (mọi level) ra file, ghi theo lô ở thread riêng")
+    parser.add_argument("--record", help="Ghi mọi HTTP request ra log nhị phân (không dùng với --workers)")
+    parser.add_argument("--replay", help="Phát lại log đã ghi bằng --record thay vì chạy simulation (kèm --accounts để thay token đã ghi bằng token mới)")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="1 = đúng nhịp gốc, k = nhanh gấp k lần, 0 = nhanh nhất có thể")
+    parser.add_argument("--seed", type=int, help="Seed cho random để các lần chạy giống nhau")
+    parser.add_argument("--metrics", help="Prefix file thống kê, ghi ra <prefix>.json và <prefix>.csv")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, help="Chu kỳ ghi file thống kê (giây)")
+    args = parser.parse_args()
+    if args.route_paths and not args.synthetic:
+        # Trip giả lập không có trong DB: server thật trả 404 cho mọi request và làm sai thống kê
+        parser.error("--route-paths creates trips the API server does not know, pass --synthetic to run them anyway")
+    if args.route_paths and args.mode != "fleet":
+        parser.error("--route-paths only works with --mode fleet")
+    if args.record and args.workers != 1:
+        # Mỗi worker có HttpTransport riêng, recorder của process chính không thấy request nào
+        parser.error("--record only works with --workers 1")
+
     # Danh sách access tokens của các driver
     ACCESS_TOKENS = [
         "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.example1",
@@ -384,20 +2935,111 @@ if __name__ == "__main__":
     
     # Base URL của API server
     BASE_URL = "http://localhost:3000"
+
+    # Giới hạn connection pool dùng chung
+    MAX_CONNECTIONS = 1000
+    MAX_CONNECTIONS_PER_HOST = 200
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.replay:
+        try:
+            transport = HttpTransport(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST)
+            asyncio.run(replay_request_log(
+                args.replay, BASE_URL, transport, args.replay_speed, metrics_prefix=args.metrics,
+                token_pool=TokenPool(BASE_URL, args.token_cache, args.login_concurrency) if args.accounts else None,
+                credentials=load_accounts(args.accounts) if args.accounts else None,
+            ))
+        except KeyboardInterrupt:
+            print("\n👋 Goodbye!")
+        exit(0)
     
-    if not ACCESS_TOKENS or ACCESS_TOKENS[0].endswith("example1"):
+    token_pool = None
+    if args.accounts:
+        token_pool = TokenPool(BASE_URL, args.token_cache, args.login_concurrency)
+
+        async def login_all() -> List[DriverSession]:
+            try:
+                return await token_pool.login_all(load_accounts(args.accounts))
+            finally:
+                await token_pool.close()
+
+        ACCESS_TOKENS = [session.access_token for session in asyncio.run(login_all())]
+        if not ACCESS_TOKENS:
+            print("❌ No driver could log in, check --accounts and the API server")
+            exit(1)
+    elif not ACCESS_TOKENS or ACCESS_TOKENS[0].endswith("example1"):
         print("⚠️  Please update ACCESS_TOKENS with real tokens!")
-        print("📝 Edit the ACCESS_TOKENS list in the script")
+        print("📝 Edit the ACCESS_TOKENS list in the script or pass --accounts")
         exit(1)
     
+    if args.transport == "socket":
+        if args.socket_ack_timeout <= 0:
+            print("⚠️  No-ack mode: socket rows only measure the local write and are reported as \"SOCKET (no ack)\"")
+
     print("🚌 Bus Route Simulator")
     print("=" * 50)
     print(f"🔗 API Server: {BASE_URL}")
     print(f"👥 Drivers: {len(ACCESS_TOKENS)}")
+    if args.route_paths:
+        print(f"🧪 Synthetic trips: {args.buses} buses from {args.route_paths}, the server must accept sim-* trip ids")
     print("=" * 50)
     
+    recorder = None
     try:
         # Chạy simulation
-        asyncio.run(run_multiple_simulators(ACCESS_TOKENS, BASE_URL))
+        transport = HttpTransport(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST)
+        if args.record:
+            recorder = transport.recorder = RequestRecorder(args.record)
+        clock_start = parse_clock_start(args.clock_start) if args.clock_start else None
+        if args.discrete:
+            clock = DiscreteClock(clock_start)
+        elif args.time_scale != 1.0 or clock_start is not None:
+            clock = ScaledClock(args.time_scale, clock_start)
+        else:
+            clock = Clock()
+        by_hour = {
+            int(hour): float(kmh)
+            for hour, kmh in (item.split(":") for item in args.speed_by_hour.split(",") if item)
+        }
+        options = FleetOptions(
+            use_socket=args.transport == "socket",
+            socket_ack_timeout=args.socket_ack_timeout if args.socket_ack_timeout > 0 else None,
+            motion=MotionConfig(args.gps_interval, SpeedProfile(args.speed, by_hour)),
+            open_loop=args.open_loop,
+            max_in_flight=args.max_in_flight,
+            max_backlog=args.max_backlog,
+            token_pool=token_pool,
+            console_level=LOG_LEVELS[args.log_level],
+            log_path=args.log_file,
+            dashboard=args.dashboard,
+            flow=FlowControl(
+                max_in_flight=args.fleet_in_flight,
+                per_bus=args.bus_in_flight,
+                max_retries=args.max_retries,
+                failure_threshold=args.breaker_threshold,
+                reset_timeout=args.breaker_reset,
+            ) if args.flow_control else None,
+            clock=clock,
+        )
+        if args.workers != 1:
+            run_sharded(
+                ACCESS_TOKENS, BASE_URL, args.workers, args.mode, metrics_prefix=args.metrics, options=options,
+                route_paths_file=args.route_paths, buses=args.buses,
+            )
+        elif args.mode == "fleet":
+            asyncio.run(run_fleet(
+                ACCESS_TOKENS, BASE_URL, transport, args.route_paths, args.buses,
+                args.metrics, args.metrics_interval, options,
+            ))
+        else:
+            asyncio.run(run_multiple_simulators(
+                ACCESS_TOKENS, BASE_URL, transport, args.metrics, args.metrics_interval, options,
+            ))
     except KeyboardInterrupt:
-        print("\n👋 Goodbye!")
\ No newline at end of file
+        print("\n👋 Goodbye!")
+    finally:
+        if recorder is not None:
+            recorder.close()
+            print(f"💾 Recorded {recorder.records} requests to {recorder.path}")
\ No newline at end of file
@@ -0,0 +1,589 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from audo import (
+    LOCATION_PATH, DiscreteClock, FleetEngine, FleetOptions, FlowControl, HttpTransport, LatencyHistogram,
+    LookupCache, MotionConfig, RequestRecorder, SpeedProfile, TokenPool, Trip, WARNING, event_log, jwt_expiry,
+    orjson, plan_trip, replay_request_log,
+)
+
+
+# Tâm TP.HCM, các tuyến giả lập được sinh quanh điểm này
+CENTER_LNG = 106.70
+CENTER_LAT = 10.78
+
+
+def make_path(seed: int, points: int = 200, step: float = 2e-4) -> List[List[float]]:
+    """Sinh path [lng, lat] xác định theo seed, đi thẳng theo một hướng với độ cong nhẹ"""
+    angle = (seed * 2.399963) % (2 * math.pi)
+    lng, lat = CENTER_LNG, CENTER_LAT
+    path = []
+    for i in range(points):
+        heading = angle + 0.3 * math.sin(i / 15)
+        lng += step * math.cos(heading)
+        lat += step * math.sin(heading)
+        path.append([round(lng, 6), round(lat, 6)])
+    return path
+
+
+def make_trip(trip_id: str, seed: int, points: int = 200, stops: int = 8) -> Dict:
+    """Trip detail giống response của /api/drivers/trip/{trip_id}"""
+    path = make_path(seed, points)
+    stride = max(points // (stops + 1), 1)
+    return {
+        "id": trip_id,
+        "rotute": {"id": f"route-{seed}", "name": f"Route {seed}", "path": path},
+        "stops": [
+            {"id": f"{trip_id}-stop-{i}", "name": f"Stop {i}", "location": path[(i + 1) * stride], "sequence": i + 1}
+            for i in range(stops)
+        ],
+    }
+
+
+def make_token(username: str, ttl: float, kind: str = "access") -> str:
+    """Token dạng JWT (không ký) có claim exp, đủ để client đọc hạn dùng"""
+    claims = {"sub": username, "kind": kind, "exp": int(time.time() + ttl), "jti": os.urandom(4).hex()}
+    encode = lambda data: base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return f"{encode({'alg': 'none'})}.{encode(claims)}.stub"
+
+
+def token_subject(token: str) -> str:
+    """Tài khoản của token do make_token cấp, token tuỳ ý thì dùng chính nó"""
+    if jwt_expiry(token) is None:
+        return token
+    payload = token.split(".")[1]
+    return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["sub"]
+
+
+class StubDriverApi:
+    """
+    Server giả lập các endpoint /api/auth/... và /api/drivers/... mà BusSimulator gọi, mỗi token có đúng một trip.
+    Token dạng JWT đã hết hạn bị trả 401; token tuỳ ý khác (vd. "bench-1") luôn hợp lệ.
+    Vị trí gửi tới trip đã kết thúc bị trả 409.
+    """
+
+    def __init__(
+        self,
+        points: int = 200,
+        stops: int = 8,
+        latency: float = 0.0,
+        token_ttl: float = 3600.0,
+        routes: int = 50,
+    ):
+        self.points = points
+        self.stops = stops
+        # Các trip được chia đều cho routes tuyến, trip cùng tuyến có cùng path
+        self.routes = routes
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.requests = 0
+        self._trips: Dict[str, Dict] = {}
+        self._ended = set()
+        self.app = web.Application(middlewares=[self.check_token])
+        self.app.router.add_post("/api/auth/login", self.login)
+        self.app.router.add_post("/api/auth/refresh", self.refresh)
+        self.app.router.add_get("/api/drivers/schedules/today", self.schedules_today)
+        self.app.router.add_get("/api/drivers/trip/{trip_id}", self.trip_detail)
+        self.app.router.add_post("/api/drivers/trip/{trip_id}/start", self.start)
+        self.app.router.add_post("/api/drivers/trip/{trip_id}/location", self.location)
+        self.app.router.add_post("/api/drivers/trip/{trip_id}/stoppoint/{stop_id}/arrive", self.ok)
+        self.app.router.add_post("/api/drivers/trip/{trip_id}/stoppoint/{stop_id}/depart", self.ok)
+        self.app.router.add_post("/api/drivers/trip/{trip_id}/students/{student_id}/pickup", self.ok)
+        self.app.router.add_post("/api/drivers/trip/{trip_id}/students/{student_id}/dropoff", self.ok)
+        self.app.router.add_get("/api/drivers/trip/{trip_id}/end", self.end)
+
+    async def _respond(self, data, status: int = 200) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"code": status, "message": "OK", "data": data}, status=status)
+
+    @web.middleware
+    async def check_token(self, request: web.Request, handler):
+        if request.path.startswith("/api/drivers/"):
+            token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            expiry = jwt_expiry(token)
+            if not token or (expiry is not None and expiry <= time.time()):
+                return await self._respond(None, 401)
+        return await handler(request)
+
+    async def login(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        username = body.get("username")
+        if not username or not body.get("password"):
+            return await self._respond(None, 400)
+        return await self._respond({
+            "id": username,
+            "username": username,
+            "accessToken": make_token(username, self.token_ttl),
+            "refreshToken": make_token(username, self.token_ttl * 24, "refresh"),
+        })
+
+    async def refresh(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        expiry = jwt_expiry(body.get("refreshToken"))
+        if expiry is None or expiry <= time.time():
+            return await self._respond(None, 400)
+        return await self._respond({"accessToken": make_token(token_subject(body["refreshToken"]), self.token_ttl)})
+
+    async def schedules_today(self, request: web.Request) -> web.Response:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        # Trip gắn với tài khoản, không đổi khi token được refresh
+        schedule = {"tripId": f"trip-{token_subject(token)}", "static": "PLANNED", "type": "DISPATH"}
+        return await self._respond({"data": [schedule]})
+
+    async def trip_detail(self, request: web.Request) -> web.Response:
+        trip_id = request.match_info["trip_id"]
+        trip = self._trips.get(trip_id)
+        if trip is None:
+            trip = self._trips[trip_id] = make_trip(trip_id, len(self._trips) % self.routes, self.points, self.stops)
+        return await self._respond(trip)
+
+    async def ok(self, request: web.Request) -> web.Response:
+        return await self._respond({"ok": True})
+
+    async def start(self, request: web.Request) -> web.Response:
+        self._ended.discard(request.match_info["trip_id"])
+        return await self._respond({"ok": True})
+
+    async def location(self, request: web.Request) -> web.Response:
+        if request.match_info["trip_id"] in self._ended:
+            return await self._respond(None, 409)
+        return await self._respond({"ok": True})
+
+    async def end(self, request: web.Request) -> web.Response:
+        self._ended.add(request.match_info["trip_id"])
+        return await self._respond({"ok": True})
+
+    async def serve(self, host: str, port: int, ready=None, stop=None):
+        """Chạy server tới khi stop (mp.Event) được set, hoặc mãi mãi nếu không có"""
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        if ready is not None:
+            ready.set()
+        try:
+            while stop is None or not stop.is_set():
+                await asyncio.sleep(0.2)
+        finally:
+            await runner.cleanup()
+
+
+def _stub_worker(
+    host: str, port: int, points: int, stops: int, latency: float, token_ttl: float, routes: int, ready, stop,
+):
+    asyncio.run(StubDriverApi(points, stops, latency, token_ttl, routes).serve(host, port, ready, stop))
+
+
+@contextlib.contextmanager
+def stub_server(
+    host: str = "127.0.0.1",
+    port: int = 8787,
+    points: int = 200,
+    stops: int = 8,
+    latency: float = 0.0,
+    routes: int = 50,
+    token_ttl: float = 3600.0,
+):
+    """Chạy stub ở process riêng để CPU của server không tính vào CPU của simulator"""
+    ready, stop = mp.Event(), mp.Event()
+    process = mp.Process(
+        target=_stub_worker, args=(host, port, points, stops, latency, token_ttl, routes, ready, stop), daemon=True,
+    )
+    process.start()
+    try:
+        if not ready.wait(10):
+            raise RuntimeError("Stub driver API failed to start")
+        yield f"http://{host}:{port}"
+    finally:
+        stop.set()
+        process.join(5)
+
+
+def bench_memory(
+    buses: int,
+    points: int = 200,
+    stops: int = 8,
+    motion: Optional[MotionConfig] = None,
+    routes: int = 50,
+) -> Dict:
+    """Bộ nhớ giữ lại cho mỗi xe trong FleetEngine (path dùng chung theo route + kế hoạch chạy + trạng thái)"""
+    payloads = [json.dumps(make_trip(f"trip-{i}", i % routes, points, stops)).encode() for i in range(buses)]
+
+    async def build() -> Dict:
+        options = FleetOptions(motion=motion)
+        simulator = options.new_simulator("bench", "http://127.0.0.1:1")
+        engine = FleetEngine(options.motion)
+        paths = {}
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for payload in payloads:
+            engine.add_trip(simulator, Trip.from_json(json.loads(payload), paths))
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        await simulator.close()
+        return {"buses": buses, "routes": routes, "bytes_per_bus": retained / buses, "total_mb": retained / 1e6}
+
+    return asyncio.run(build())
+
+
+def bench_fleet(
+    base_url: str,
+    buses: int,
+    duration: float,
+    motion: MotionConfig,
+    open_loop: bool = False,
+) -> Dict:
+    """Chạy FleetEngine với stub, đo events/giây trên mỗi giây CPU và độ lệch tick"""
+
+    async def run() -> Dict:
+        options = FleetOptions(motion=motion, open_loop=open_loop)
+        transport = HttpTransport()
+        cache = LookupCache()
+        sender = options.new_open_loop()
+        simulators = [options.new_simulator(f"bench-{i}", base_url, transport, cache, sender) for i in range(buses)]
+        engine = FleetEngine(options.motion, report_interval=duration * 10, open_loop=sender)
+        # Log từng sự kiện của simulator không phải thứ cần đo, chỉ giữ cảnh báo/lỗi
+        event_log.configure(console_level=WARNING)
+        event_log.start()
+        # Rải đều thời điểm xuất phát trong một chu kỳ GPS để đo jitter ở trạng thái ổn định
+        await engine.load_from_simulators(simulators, stagger=motion.gps_interval / buses)
+        task = asyncio.create_task(engine.run())
+        # Bỏ qua chu kỳ đầu: sự kiện xuất phát bị trễ bởi thời gian nạp trip, không phải jitter của scheduler
+        await asyncio.sleep(motion.gps_interval * 2)
+        engine.tick_lag = LatencyHistogram()
+        events, requests = engine.events, transport.stats.requests
+        cpu, wall = time.process_time(), time.perf_counter()
+        await asyncio.sleep(duration)
+        events, requests = engine.events - events, transport.stats.requests - requests
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        engine.stop()
+        await task
+        for simulator in simulators:
+            await simulator.close()
+        await transport.close()
+        await event_log.close()
+
+        stats = transport.stats
+        return {
+            "buses": buses,
+            "events": events,
+            "requests": requests,
+            "errors": stats.errors,
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "events_per_sec": events / wall,
+            "events_per_cpu_sec": events / max(cpu, 1e-9),
+            "cpu_utilization": cpu / wall,
+            "tick_lag_p50_ms": engine.tick_lag.percentile(50) * 1000,
+            "tick_lag_p99_ms": engine.tick_lag.percentile(99) * 1000,
+            "tick_lag_max_ms": engine.tick_lag.max * 1000,
+        }
+
+    return asyncio.run(run())
+
+
+def bench_request_path(base_url: str, requests: int = 5000, concurrency: int = 50, rounds: int = 10) -> Dict:
+    """
+    CPU phía client cho mỗi request cập nhật vị trí: đường cũ (dict, aiohttp tự json.dumps) so với body đã
+    encode sẵn của BusSimulator.update_location. Stub chạy ở process khác nên
+    time.process_time chỉ tính CPU của client; hai đường chạy xen kẽ từng vòng, báo trung vị và độ lệch chuẩn
+    của mức tiết kiệm theo cặp để biết chênh lệch có vượt nhiễu hay không.
+    """
+
+    async def run() -> Dict:
+        transport = HttpTransport()
+        simulator = FleetOptions().new_simulator("bench-encode", base_url, transport)
+        trip_id = "trip-0"
+
+        async def legacy(i: int):
+            payload = {"latitude": CENTER_LAT + i * 1e-6, "longitude": CENTER_LNG + i * 1e-6}
+            url = f"{base_url}{LOCATION_PATH.format(trip_id=trip_id)}"
+            await transport.request("POST", url, headers=simulator.headers, json=payload, endpoint=LOCATION_PATH)
+
+        async def fast(i: int):
+            await simulator.update_location(trip_id, CENTER_LAT + i * 1e-6, CENTER_LNG + i * 1e-6)
+
+        async def measure(send) -> float:
+            cpu = time.process_time()
+            for start in range(0, requests, concurrency):
+                await asyncio.gather(*(send(i) for i in range(start, min(start + concurrency, requests))))
+            return (time.process_time() - cpu) / requests
+
+        # Làm nóng connection pool trước khi đo
+        await measure(fast)
+        legacy_cpu, fast_cpu = [], []
+        for i in range(rounds):
+            # Đổi thứ tự mỗi vòng để GC/cache không luôn thiên về một bên
+            order = (legacy, fast) if i % 2 == 0 else (fast, legacy)
+            results = {send: await measure(send) for send in order}
+            legacy_cpu.append(results[legacy])
+            fast_cpu.append(results[fast])
+        errors = transport.stats.errors
+        await simulator.close()
+        await transport.close()
+        saved = [(old - new) * 1e6 for old, new in zip(legacy_cpu, fast_cpu)]
+        return {
+            "requests": requests * rounds * 2,
+            "rounds": rounds,
+            "errors": errors,
+            "encoder": "orjson" if orjson is not None else "json",
+            "legacy_us": statistics.median(legacy_cpu) * 1e6,
+            "fast_us": statistics.median(fast_cpu) * 1e6,
+            "saved_us": statistics.median(saved),
+            "saved_stdev_us": statistics.stdev(saved) if rounds > 1 else 0.0,
+        }
+
+    return asyncio.run(run())
+
+
+def check_discrete_clock(base_url: str, motion: Optional[MotionConfig] = None, poll_interval: float = 120.0, seed: int = 1) -> Dict:
+    """
+    Chạy một trip ở chế độ discrete-event, bên cạnh một task quét lịch mỗi poll_interval giây (như
+    run_continuous_simulation). Thời gian request tới stub không được tính vào clock, nên trip phải kết thúc
+    đúng thời lượng đã lên kế hoạch (sai lệch không quá một chu kỳ GPS).
+    """
+    motion = motion or MotionConfig()
+
+    async def run() -> Dict:
+        clock = DiscreteClock()
+        options = FleetOptions(motion=motion, clock=clock)
+        transport = HttpTransport()
+        transport.clock = clock
+        cache = LookupCache(clock=clock)
+        simulator = options.new_simulator("bench-clock", base_url, transport, cache)
+        event_log.configure(console_level=WARNING)
+        event_log.start()
+        trip = await simulator.get_trip_detail("trip-bench-clock")
+        # Cùng seed thì simulate_trip lên đúng kế hoạch này (thời gian dừng ngẫu nhiên)
+        random.seed(seed)
+        planned = plan_trip(trip.path, trip.stops, motion, clock.seconds_of_day()).duration
+
+        async def poll():
+            while True:
+                await simulator.get_today_schedules()
+                await clock.sleep(poll_interval)
+
+        poller = asyncio.create_task(poll())
+        random.seed(seed)
+        started = clock.time()
+        await simulator.simulate_trip(trip)
+        elapsed = clock.time() - started
+        poller.cancel()
+        await asyncio.gather(poller, return_exceptions=True)
+        await simulator.close()
+        await transport.close()
+        await event_log.close()
+        return {
+            "planned_s": planned,
+            "elapsed_s": elapsed,
+            "requests": transport.stats.requests,
+            "ok": abs(elapsed - planned) <= motion.gps_interval,
+        }
+
+    return asyncio.run(run())
+
+
+def check_open_loop_end(base_url: str, seed: int = 1) -> Dict:
+    """
+    Gửi vị trí open-loop rồi kết thúc trip, cả qua simulate_trip (discrete clock) lẫn FleetEngine (path ngắn):
+    end_trip phải tới server sau mọi vị trí của trip, nếu không stub trả 409.
+    """
+
+    async def run() -> Dict:
+        event_log.configure(console_level=WARNING)
+        event_log.start()
+        clock = DiscreteClock()
+        options = FleetOptions(motion=MotionConfig(), clock=clock, open_loop=True)
+        transport = HttpTransport()
+        transport.clock = clock
+        open_loop = options.new_open_loop()
+        simulator = options.new_simulator("bench-open-loop", base_url, transport, LookupCache(clock=clock), open_loop)
+        trip = await simulator.get_trip_detail("trip-bench-open-loop")
+        random.seed(seed)
+        await simulator.simulate_trip(trip)
+
+        motion = MotionConfig(0.02, SpeedProfile(200.0))
+        fleet_options = FleetOptions(motion=motion, open_loop=True)
+        fleet_open_loop = fleet_options.new_open_loop()
+        fleet_simulator = fleet_options.new_simulator("bench-open-loop", base_url, transport, LookupCache(), fleet_open_loop)
+        engine = FleetEngine(motion, open_loop=fleet_open_loop)
+        path = [[10.77, 106.69 + i * 1e-4] for i in range(20)]
+        engine.add_route_paths([fleet_simulator], {"open-loop": [path]}, 5)
+        await engine.run()
+
+        await open_loop.drain()
+        await fleet_open_loop.drain()
+        for s in (simulator, fleet_simulator):
+            await s.close()
+        await transport.close()
+        await event_log.close()
+        codes = transport.stats.status_codes.get(f"POST {LOCATION_PATH}", {})
+        return {"locations": sum(codes.values()), "after_end": codes.get(409, 0), "ok": not codes.get(409)}
+
+    return asyncio.run(run())
+
+
+def check_record_replay(base_url: str, drivers: int = 3, locations: int = 5) -> Dict:
+    """
+    Ghi log với FlowControl retry request lỗi: mỗi request chỉ được ghi một lần. Log được ghi bằng token
+    đã hết hạn; phát lại kèm TokenPool thì mọi request phải dùng token mới (không có 401).
+    """
+
+    async def run() -> Dict:
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "requests.log")
+            transport = HttpTransport()
+            transport.flow = FlowControl(max_retries=2, backoff_base=0.01)
+            transport.recorder = RequestRecorder(log_path)
+            # Port không có server: GET bị lỗi kết nối và được retry
+            try:
+                await transport.request("GET", "http://127.0.0.1:1/api/drivers/schedules/today")
+            except Exception:
+                pass
+            retried = transport.flow.counters["retried"]
+            for driver in range(drivers):
+                headers = {"Authorization": f"Bearer {make_token(f'bench-replay-{driver}', -60)}"}
+                for i in range(locations):
+                    await transport.request(
+                        "POST", f"{base_url}/api/drivers/trip/trip-bench-replay-{driver}/location",
+                        headers=headers, json={"latitude": 10.77 + i * 1e-4, "longitude": 106.69}, endpoint=LOCATION_PATH,
+                    )
+            transport.recorder.close()
+            recorded = transport.recorder.records
+            await transport.close()
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                stale = HttpTransport()
+                await replay_request_log(log_path, base_url, stale, speed=0)
+                fresh = HttpTransport()
+                pool = TokenPool(base_url, cache_path=None)
+                credentials = [(f"bench-replay-{driver}", "secret") for driver in range(drivers)]
+                await replay_request_log(log_path, base_url, fresh, speed=0, token_pool=pool, credentials=credentials)
+            stale_codes = stale.stats.status_codes.get(f"POST {LOCATION_PATH}", {})
+            fresh_codes = fresh.stats.status_codes.get(f"POST {LOCATION_PATH}", {})
+            expected = 1 + drivers * locations
+            return {
+                "recorded": recorded,
+                "expected": expected,
+                "retried": retried,
+                "stale_401": stale_codes.get(401, 0),
+                "fresh_200": fresh_codes.get(200, 0),
+                "ok": retried > 0 and recorded == expected and fresh_codes == {200: drivers * locations},
+            }
+
+    return asyncio.run(run())
+
+
+def print_results(results: Dict):
+    memory, fleet = results.get("memory"), results.get("fleet")
+    if memory and fleet:
+        print(
+            f"🧠 Memory: {memory['bytes_per_bus'] / 1024:.1f} KiB/bus "
+            f"({memory['total_mb']:.1f} MB for {memory['buses']} buses on {memory['routes']} routes)"
+        )
+        print(
+            f"⚡ Throughput: {fleet['events_per_cpu_sec']:.0f} events/s per core "
+            f"({fleet['events']} events, {fleet['requests']} requests, {fleet['errors']} errors, "
+            f"{fleet['cpu_utilization'] * 100:.0f}% CPU over {fleet['wall_s']:.1f}s)"
+        )
+        print(
+            f"⏱️  Tick jitter: p50 {fleet['tick_lag_p50_ms']:.2f} / p99 {fleet['tick_lag_p99_ms']:.2f} "
+            f"/ max {fleet['tick_lag_max_ms']:.2f} ms"
+        )
+    request_path = results.get("request_path")
+    if request_path:
+        print(
+            f"📨 Location request CPU: {request_path['fast_us']:.1f} µs (was {request_path['legacy_us']:.1f} µs, "
+            f"saved {request_path['saved_us']:.1f} ± {request_path['saved_stdev_us']:.1f} µs/request "
+            f"over {request_path['rounds']} rounds with {request_path['encoder']})"
+        )
+    clock = results.get("discrete_clock")
+    if clock:
+        print(
+            f"{'✅' if clock['ok'] else '❌'} Discrete clock: trip took {clock['elapsed_s']:.0f}s of clock time "
+            f"(planned {clock['planned_s']:.0f}s, {clock['requests']} requests)"
+        )
+    open_loop = results.get("open_loop_end")
+    if open_loop:
+        print(
+            f"{'✅' if open_loop['ok'] else '❌'} Open-loop trip end: {open_loop['after_end']} of "
+            f"{open_loop['locations']} locations reached the server after end_trip"
+        )
+    replay = results.get("record_replay")
+    if replay:
+        print(
+            f"{'✅' if replay['ok'] else '❌'} Record/replay: {replay['recorded']} records for {replay['expected']} "
+            f"requests ({replay['retried']} retries); replay got {replay['stale_401']} × 401 with recorded tokens, "
+            f"{replay['fresh_200']} × 200 with --accounts"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BusSimulator/FleetEngine với stub driver API chạy local")
+    parser.add_argument("--buses", type=int, default=500, help="Số xe giả lập")
+    parser.add_argument("--duration", type=float, default=20.0, help="Thời gian đo throughput (giây)")
+    parser.add_argument("--gps-interval", type=float, default=1.0, help="Chu kỳ gửi vị trí (giây)")
+    parser.add_argument("--points", type=int, default=200, help="Số điểm trên path của mỗi trip")
+    parser.add_argument("--routes", type=int, default=50, help="Số tuyến khác nhau, các xe chia đều theo tuyến")
+    parser.add_argument("--stops", type=int, default=8, help="Số điểm dừng mỗi trip")
+    parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ giả lập của stub (giây)")
+    parser.add_argument("--open-loop", action="store_true", help="Gửi vị trí theo chế độ open-loop")
+    parser.add_argument("--token-ttl", type=float, default=3600.0, help="Hạn dùng access token do stub cấp (giây)")
+    parser.add_argument("--port", type=int, default=8787, help="Port của stub driver API")
+    parser.add_argument("--serve", action="store_true", help="Chỉ chạy stub driver API để dùng với audo.py")
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON để so sánh giữa các lần chạy")
+    parser.add_argument("--check", action="store_true",
+                        help="Chỉ chạy các kiểm tra đúng đắn (discrete clock, thứ tự end_trip open-loop, record/replay), thoát với mã lỗi nếu không đạt")
+    args = parser.parse_args()
+
+    if args.serve:
+        print(f"🧪 Stub driver API listening on http://127.0.0.1:{args.port}")
+        try:
+            asyncio.run(StubDriverApi(args.points, args.stops, args.latency, args.token_ttl, args.routes).serve("127.0.0.1", args.port))
+        except KeyboardInterrupt:
+            pass
+    elif args.check:
+        # Stub có độ trễ để request tốn thời gian thật
+        with stub_server(port=args.port, points=args.points, stops=args.stops, latency=max(args.latency, 0.02)) as base_url:
+            results = {
+                "discrete_clock": check_discrete_clock(base_url),
+                "open_loop_end": check_open_loop_end(base_url),
+                "record_replay": check_record_replay(base_url),
+            }
+        print_results(results)
+        sys.exit(0 if all(check["ok"] for check in results.values()) else 1)
+    else:
+        motion = MotionConfig(args.gps_interval, SpeedProfile(), dwell_range=(args.gps_interval, args.gps_interval * 2))
+        results = {"memory": bench_memory(args.buses, args.points, args.stops, motion, args.routes)}
+        with stub_server(
+            port=args.port, points=args.points, stops=args.stops, latency=args.latency, routes=args.routes,
+            token_ttl=args.token_ttl,
+        ) as base_url:
+            results["fleet"] = bench_fleet(base_url, args.buses, args.duration, motion, args.open_loop)
+            results["request_path"] = bench_request_path(base_url)
+            results["discrete_clock"] = check_discrete_clock(base_url)
+            results["open_loop_end"] = check_open_loop_end(base_url)
+            results["record_replay"] = check_record_replay(base_url)
+        results["cpu_count"] = os.cpu_count()
+        print_results(results)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"💾 Results saved to {args.output}")
@@ -5,7 +5,8 @@ import prisma from "@src/config/prisma.config";
 import * as shareType from "@src/types/share.type";
 import { GeoLocation, RouteInfo } from "@src/types/share.type";
 import { JWT_AUTH, usePremisstion } from "@src/utils/jwt";
-import { notifyBusArrivalStation, notifyBusDepartureStation, notifyDropoffStudent, notifyPickupStudent, notifyTripStart, sendLiveLocationUpdate } from "@src/utils/socketio";
+import { decodeRoutePath } from "@src/utils/polylineUtils";
+import { notifyBusArrivalStation, notifyBusDepartureStation, notifyDropoffStudent, notifyPickupStudent, notifyTripStart, updateTripLocation } from "@src/utils/socketio";
 import crypto from "crypto";
 import * as get_schedulesType from "./types/get_schedules.type";
 import * as get_tripType from "./types/get_trip.type";
@@ -165,7 +166,7 @@ export default class DriverController {
             throw new NotFoundError("Trip not found");
         }
 
-        const routePath = JSON.parse((trip.Schedule.Route.meta as any)?.encodedPath) as number[][][] | undefined;
+        const routePath = decodeRoutePath((trip.Schedule.Route.meta as any)?.encodedPath);
         const dispathPath = routePath ? routePath[0] || [] : [];
         const returnPath = routePath ? routePath[1] || routePath[0] || [] : [];
         // console.log("routePath", dispathPath, returnPath);
@@ -454,21 +455,7 @@ export default class DriverController {
 
         const { latitude, longitude } = req.body;
 
-        const currentDate = new Date();
-
-        const locationRecord = await prisma.trackingBusHistory.create({
-            data: {
-                id: currentDate.getTime().toString() + "-" + tripId,
-                tripId: tripId,
-                location: [
-                    latitude,
-                    longitude
-                ] as any,
-                timestamp: currentDate,
-            }
-        });
-
-        sendLiveLocationUpdate(tripId, {
+        await updateTripLocation(tripId, {
             lat: latitude,
             lng: longitude
         });
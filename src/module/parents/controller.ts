@@ -7,6 +7,7 @@ import { Get, Post, Put, Delete, useAuth, Summary } from "@lib/httpMethod";
 import prisma from "@src/config/prisma.config";
 import { Validate } from "@lib/validate";
 import { JWT_AUTH, usePremisstion } from "@src/utils/jwt";
+import { decodeRoutePath } from "@src/utils/polylineUtils";
 import { GeoLocation, StopPointsData, StudentData } from "@src/types/share.type";
 import { StopPoints } from "@src/module/routes/types/create.type";
 import { NotBeforeError } from "jsonwebtoken";
@@ -251,7 +252,7 @@ export default class ParentController {
             throw new NotFoundError("No current trip found for today");
         }
 
-        const routePath = JSON.parse((currentTrip.Schedule.Route.meta as any)?.encodedPath) as [number, number][][] | undefined;
+        const routePath = decodeRoutePath((currentTrip.Schedule.Route.meta as any)?.encodedPath);
         const dispathPath = routePath ? routePath[0] || [] : [];
         const returnPath = routePath ? routePath[1] || routePath[0] || [] : [];
 
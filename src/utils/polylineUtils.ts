@@ -97,3 +97,17 @@ export function decodePolyline(encodedStr: string, precision: number = 5): [numb
 
     return coordinates;
 }
+
+/**
+ * Đọc Route.meta.encodedPath thành path từng chiều dạng [[lng, lat], ...].
+ * Hỗ trợ cả dữ liệu cũ (mảng tọa độ) lẫn dữ liệu mới (mảng chuỗi polyline đã giản lược).
+ * @param encodedPath Giá trị encodedPath trong meta (chuỗi JSON hoặc đã parse)
+ * @returns Mảng path theo chiều, hoặc undefined nếu không có
+ */
+export function decodeRoutePath(encodedPath: unknown): [number, number][][] | undefined {
+    if (encodedPath === undefined || encodedPath === null) {
+        return undefined;
+    }
+    const paths = (typeof encodedPath === 'string' ? JSON.parse(encodedPath) : encodedPath) as (string | [number, number][])[];
+    return paths.map(path => typeof path === 'string' ? decodePolyline(path) : path);
+}
@@ -10,7 +10,14 @@ interface SocketEvents {
     NewNotification: (notification: any) => void;
     LiveLocationUpdate: (location: { lat: number; lng: number }) => void;
     SystemAlert: (message: string) => void;
-    UpdateLocation: (location: { lat: number; lng: number }) => void;
+    UpdateLocation: (location: { lat: number; lng: number }, tripId: string, ack?: (result: UpdateLocationAck) => void) => void;
+}
+
+// giống trip_locationRes của POST /api/drivers/trip/:tripId/location, kèm status để client thống kê
+interface UpdateLocationAck {
+    ok: boolean;
+    status: number;
+    message?: string;
 }
 
 
@@ -53,6 +60,33 @@ export function setSocketIO(socketIO: Server) {
             console.log(`Socket joining trip room: /trip:${tripId}`);
             socket.join(`/trip:${tripId}`);
         });
+
+        // tài xế stream vị trí qua socket thay cho POST /api/drivers/trip/:tripId/location
+        socket.on('UpdateLocation', async (location, tripId, ack) => {
+            const reply = (result: UpdateLocationAck) => typeof ack === 'function' && ack(result);
+            let user;
+            try {
+                const token = socket.handshake.auth?.token || socket.handshake.headers.authorization?.replace(/^Bearer /, '');
+                user = verifyAccessToken(token).user;
+            }
+            catch (err) {
+                return reply({ ok: false, status: 401, message: 'Invalid access token' });
+            }
+            if (!user.permissions?.includes('update:driver_location')) {
+                return reply({ ok: false, status: 403, message: 'You do not have permission(update:driver_location)' });
+            }
+            if (typeof tripId !== 'string' || typeof location?.lat !== 'number' || typeof location?.lng !== 'number') {
+                return reply({ ok: false, status: 400, message: 'Invalid location' });
+            }
+            try {
+                await updateTripLocation(tripId, location);
+                reply({ ok: true, status: 200 });
+            }
+            catch (err) {
+                console.error('Error updating trip location:', err);
+                reply({ ok: false, status: 500, message: 'Cannot update location' });
+            }
+        });
         socket.emit('Success');
 
         socket.on('disconnect', () => {
@@ -80,6 +114,25 @@ export function sendLiveLocationUpdate(tripId: string, location: { lat: number;
     }, tripId);
 }
 
+// lưu vị trí vào lịch sử của trip rồi gửi cho các client trong room của trip
+export async function updateTripLocation(tripId: string, location: { lat: number; lng: number }) {
+    const currentDate = new Date();
+
+    await prisma.trackingBusHistory.create({
+        data: {
+            id: currentDate.getTime().toString() + "-" + tripId,
+            tripId: tripId,
+            location: [
+                location.lat,
+                location.lng
+            ] as any,
+            timestamp: currentDate,
+        }
+    });
+
+    sendLiveLocationUpdate(tripId, location);
+}
+
 export function broadcastAlert(message: string) {
     if (!io) throw new Error('Socket.IO not initialized');
 
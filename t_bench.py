@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from aiohttp import web
+
+import t
+
+
+# Các bước tải từ EBMS API
+CRAWL_STAGES = [stage.name for stage in t.STAGES if stage.crawl]
+CRAWL_OUTPUTS = ["all_stop_points.json", "all_route_details.json", "route_stops.json", "route_paths.json"]
+
+
+class StubEbmsApi:
+    """
+    Server giả lập các endpoint /businfo/... của EBMS mà t.py gọi, dữ liệu xác định theo số tuyến.
+    Khoảng fail_rate URL (chọn theo hash của URL) bị trả 503 ở mọi lần gọi lẻ, nên mỗi lần crawl đều phải
+    đi qua đường retry của Crawler; /stats trả về số request server đã nhận và số request đồng thời
+    lớn nhất kể từ lần gọi /stats trước.
+    """
+
+    def __init__(self, routes: int = 20, stops: int = 6, points: int = 400, latency: float = 0.01, fail_rate: float = 0.1):
+        self.routes = routes
+        self.stops = stops
+        self.points = points
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._attempts: Dict[str, int] = {}
+        self.app = web.Application(middlewares=[self.count])
+        self.app.router.add_get("/businfo/getallroute", self.all_routes)
+        self.app.router.add_get("/businfo/getroutebyid/{route_id}", self.route_by_id)
+        self.app.router.add_get("/businfo/getstopsbyvar/{route_id}/{direction}", self.stops_by_var)
+        self.app.router.add_get("/businfo/getpathsbyvar/{route_id}/{direction}", self.paths_by_var)
+        self.app.router.add_get("/stats", self.stats)
+
+    def fails_first(self, url: str) -> bool:
+        digest = int(hashlib.sha256(url.encode("utf-8")).hexdigest()[:8], 16)
+        return digest / 0xFFFFFFFF < self.fail_rate
+
+    @web.middleware
+    async def count(self, request: web.Request, handler):
+        if request.path == "/stats":
+            return await handler(request)
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            attempt = self._attempts[request.path_qs] = self._attempts.get(request.path_qs, 0) + 1
+            if attempt % 2 == 1 and self.fails_first(request.path_qs):
+                self.failed += 1
+                return web.json_response({"message": "Service Unavailable"}, status=503)
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+
+    def stop(self, stop_id: int) -> Dict:
+        # Tên/đường có dấu nháy để đi qua phần escape SQL
+        return {
+            "StopId": stop_id, "Code": f"Q1 {stop_id:03d}", "Name": f"Bến O'{stop_id}", "StopType": "Trụ dừng",
+            "Zone": "Quận 1", "AddressNo": str(stop_id), "Street": 'Lê "Lợi"', "SupportDisability": "",
+            "Status": "Đang khai thác", "Lng": round(106.69 + stop_id * 1e-3, 6), "Lat": round(10.77 + stop_id * 1e-3, 6),
+            "Search": f"BO {stop_id}", "Routes": "1, 2", "Ward": None,
+        }
+
+    async def all_routes(self, request: web.Request) -> web.Response:
+        return web.json_response([
+            {"RouteId": route_id, "RouteNo": f"{route_id:02d}", "RouteName": f"Tuyến {route_id}"}
+            for route_id in range(1, self.routes + 1)
+        ])
+
+    async def route_by_id(self, request: web.Request) -> web.Response:
+        route_id = int(request.match_info["route_id"])
+        return web.json_response({
+            "RouteId": route_id, "RouteNo": f"{route_id:02d}", "RouteName": f"Bến Thành - Tuyến {route_id}",
+            "Color": "#0000FF", "Type": "Phổ thông - Có trợ giá", "Distance": 10000 + route_id, "Orgs": "HTX",
+            "TimeOfTrip": "40-50", "Headway": "10-15", "OperationTime": "05:00 - 20:00", "NumOfSeats": 40,
+            "OutBoundName": "Lượt đi", "InBoundName": "Lượt về", "OutBoundDescription": "", "InBoundDescription": "",
+            "TotalTrip": "180", "Tickets": "Vé lượt: 5.000 VNĐ",
+        })
+
+    async def stops_by_var(self, request: web.Request) -> web.Response:
+        route_id, direction = int(request.match_info["route_id"]), int(request.match_info["direction"])
+        # Các tuyến kề nhau dùng chung một phần điểm dừng
+        first = route_id * (self.stops // 2) + direction
+        return web.json_response([self.stop(first + i) for i in range(self.stops)])
+
+    async def paths_by_var(self, request: web.Request) -> web.Response:
+        route_id, direction = int(request.match_info["route_id"]), int(request.match_info["direction"])
+        sign = 1 if direction == 1 else -1
+        return web.json_response({
+            "lat": [round(10.77 + route_id * 1e-3 + i * 1e-4 + (i % 7) * 1e-6, 6) for i in range(self.points)],
+            "lng": [round(106.69 + sign * i * 1e-4, 6) for i in range(self.points)],
+        })
+
+    async def stats(self, request: web.Request) -> web.Response:
+        max_in_flight, self.max_in_flight = self.max_in_flight, self.in_flight
+        return web.json_response({"requests": self.requests, "failed": self.failed, "max_in_flight": max_in_flight})
+
+    async def serve(self, host: str, port: int, ready=None, stop=None):
+        """Chạy server tới khi stop (mp.Event) được set, hoặc mãi mãi nếu không có"""
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        if ready is not None:
+            ready.set()
+        try:
+            while stop is None or not stop.is_set():
+                await asyncio.sleep(0.2)
+        finally:
+            await runner.cleanup()
+
+
+def _stub_worker(host: str, port: int, routes: int, stops: int, points: int, latency: float, fail_rate: float, ready, stop):
+    asyncio.run(StubEbmsApi(routes, stops, points, latency, fail_rate).serve(host, port, ready, stop))
+
+
+@contextlib.contextmanager
+def stub_server(
+    host: str = "127.0.0.1",
+    port: int = 8801,
+    routes: int = 20,
+    stops: int = 6,
+    points: int = 400,
+    latency: float = 0.01,
+    fail_rate: float = 0.1,
+):
+    """Chạy stub ở process riêng, trả về base URL để gán cho t.EBMS_API"""
+    ready, stop = mp.Event(), mp.Event()
+    process = mp.Process(
+        target=_stub_worker, args=(host, port, routes, stops, points, latency, fail_rate, ready, stop), daemon=True,
+    )
+    process.start()
+    try:
+        if not ready.wait(10):
+            raise RuntimeError("Stub EBMS API failed to start")
+        yield f"http://{host}:{port}/businfo"
+    finally:
+        stop.set()
+        process.join(5)
+
+
+def server_stats(base_url: str) -> Dict:
+    return t.crawler.session.get(base_url.rsplit("/businfo", 1)[0] + "/stats", timeout=5).json()
+
+
+def crawl(base_url: str, directory: str, concurrency: int, rate: float, refresh: bool = False) -> Dict:
+    """
+    Chạy các bước crawl của t.py với db/ nằm trong directory (t.py dùng đường dẫn ./db tương đối),
+    trả về thời gian, số request (phía crawler và phía server) và hash các file output.
+    """
+    os.makedirs(os.path.join(directory, "db"), exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        t.EBMS_API = base_url
+        t.crawler = t.Crawler(concurrency, rate, cache=t.ResponseCache(refresh=refresh))
+        before = server_stats(base_url)["requests"]
+        started = time.perf_counter()
+        # Log từng tuyến của t.py không phải thứ cần đo
+        with contextlib.redirect_stdout(io.StringIO()):
+            t.Pipeline(t.STAGES, jobs=len(CRAWL_STAGES)).run(CRAWL_STAGES, force=True, refresh=refresh)
+        elapsed = time.perf_counter() - started
+        after = server_stats(base_url)
+        requests = after["requests"] - before
+        outputs = {name: t.file_hash(os.path.join("db", name)) for name in CRAWL_OUTPUTS}
+        return {
+            "concurrency": concurrency,
+            "rate": rate,
+            "elapsed_s": elapsed,
+            "fetched": t.crawler.fetched,
+            "server_requests": requests,
+            "max_in_flight": after["max_in_flight"],
+            "cache_hits": t.crawler.cache.hits,
+            "request_rate": requests / max(elapsed, 1e-9),
+            "outputs": outputs,
+        }
+    finally:
+        os.chdir(cwd)
+
+
+def rerun_with(directory: str, **params) -> List[str]:
+    """Chạy lại cả pipeline (dùng cache trên đĩa) với các tham số module của t.py đã đổi, trả về các bước đã chạy"""
+    defaults = {name: getattr(t, name) for name in params}
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        for name, value in params.items():
+            setattr(t, name, value)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return sorted(t.Pipeline(t.STAGES).run())
+    finally:
+        for name, value in defaults.items():
+            setattr(t, name, value)
+        os.chdir(cwd)
+
+
+def check_params_staleness(directory: str) -> List[str]:
+    """Đổi tham số dòng lệnh phải làm đúng các bước dùng tham số đó chạy lại"""
+    failures = []
+    rerun_with(directory)
+    batch_stages = ["delta_sql", "route_stops_sql", "routes_sql", "stop_points"]
+    cases = [
+        ({}, []),
+        ({"PATH_TOLERANCE_M": t.PATH_TOLERANCE_M + 5}, ["delta_sql", "route_paths_sql"]),
+        ({"DELTA_DELETES": True}, ["delta_sql"]),
+        ({"SQL_BATCH_ROWS": 50}, batch_stages),
+        ({"SQL_BATCH_BYTES": 4096}, batch_stages),
+    ]
+    for params, expected in cases:
+        ran = rerun_with(directory, **params)
+        if ran != expected:
+            failures.append(f"pipeline with {params or 'unchanged parameters'} ran {ran}, expected {expected}")
+        # Về lại tham số mặc định cho trường hợp kế tiếp
+        rerun_with(directory)
+    print(f"🔁 parameter changes: {len(cases) - len(failures)}/{len(cases)} re-ran exactly the affected stages")
+    return failures
+
+
+def run_checks(base_url: str, concurrency: int, rate: float) -> List[str]:
+    """
+    Chạy crawl tuần tự, song song có giới hạn tốc độ và từ cache, rồi đổi tham số của pipeline;
+    trả về các kiểm tra không đạt
+    """
+    failures = []
+    with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+        serial = crawl(base_url, serial_dir, 1, 0, refresh=True)
+        parallel = crawl(base_url, parallel_dir, concurrency, rate, refresh=True)
+        cached = crawl(base_url, parallel_dir, concurrency, rate)
+        for name, result in (("serial", serial), ("parallel", parallel), ("cached", cached)):
+            print(
+                f"🕷️  {name}: {result['elapsed_s']:.2f}s, {result['fetched']} URLs fetched, "
+                f"{result['server_requests']} server requests ({result['request_rate']:.1f}/s, "
+                f"up to {result['max_in_flight']} at once), "
+                f"{result['cache_hits']} disk cache hits"
+            )
+
+        if parallel["outputs"] != serial["outputs"]:
+            failures.append("parallel crawl output differs from serial crawl output")
+        if parallel["server_requests"] <= parallel["fetched"]:
+            failures.append("stub injected no failures, retry path was not exercised")
+        # Token bucket cho phép một burst bằng concurrency ở đầu lần chạy
+        if rate > 0 and parallel["server_requests"] > rate * parallel["elapsed_s"] + concurrency:
+            failures.append(f"parallel crawl exceeded {rate:g} requests/s")
+        # Các stage crawl chạy song song, mỗi stage một thread pool, nhưng dùng chung giới hạn của Crawler
+        if parallel["max_in_flight"] > concurrency:
+            failures.append(f"parallel crawl ran {parallel['max_in_flight']} requests at once, limit is {concurrency}")
+        if cached["server_requests"] != 0:
+            failures.append(f"cached crawl made {cached['server_requests']} requests, expected 0")
+        if cached["outputs"] != serial["outputs"]:
+            failures.append("cached crawl output differs from serial crawl output")
+        failures.extend(check_params_staleness(parallel_dir))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy các bước crawl của t.py với stub EBMS API chạy local")
+    parser.add_argument("--routes", type=int, default=20, help="Số tuyến của stub")
+    parser.add_argument("--stops", type=int, default=6, help="Số điểm dừng mỗi chiều của một tuyến")
+    parser.add_argument("--points", type=int, default=400, help="Số điểm trên path mỗi chiều")
+    parser.add_argument("--latency", type=float, default=0.01, help="Độ trễ giả lập của stub (giây)")
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="Tỉ lệ URL bị trả 503 trước khi thành công")
+    parser.add_argument("--concurrency", type=int, default=8, help="Số request chạy song song của crawl song song")
+    parser.add_argument("--rate", type=float, default=50.0, help="Giới hạn request/giây của crawl song song")
+    parser.add_argument("--port", type=int, default=8801, help="Port của stub EBMS API")
+    parser.add_argument("--serve", action="store_true", help="Chỉ chạy stub, dùng với EBMS_API=http://127.0.0.1:<port>/businfo")
+    args = parser.parse_args()
+
+    if args.serve:
+        print(f"🧪 Stub EBMS API listening on http://127.0.0.1:{args.port}/businfo")
+        try:
+            asyncio.run(StubEbmsApi(args.routes, args.stops, args.points, args.latency, args.fail_rate).serve("127.0.0.1", args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        with stub_server(
+            port=args.port, routes=args.routes, stops=args.stops, points=args.points,
+            latency=args.latency, fail_rate=args.fail_rate,
+        ) as base_url:
+            failures = run_checks(base_url, args.concurrency, args.rate)
+        for failure in failures:
+            print(f"❌ {failure}")
+        if failures:
+            sys.exit(1)
+        print("✅ Crawler checks passed")